@@ -0,0 +1,136 @@
+import collections
+import json
+import threading
+
+from db import helpers, metrics, users
+
+# Per-user cache of the assembled first feed page (posts with counters and
+# liked flags), so refreshing the home page doesn't rebuild it.
+#
+# Entries are evicted least recently used first once their estimated size
+# passes helpers.FEED_CACHE_BYTES. They are dropped precisely when
+# something on the page changes:
+#
+#   post_added(author)       - pages whose user is or follows the author
+#   post_changed(post_id)    - pages showing that post (likes, comments)
+#   feed_changed(username)   - that user's page (follow/unfollow)
+#
+# Both backends report these events, so the cache works with either.
+
+_lock = threading.Lock()
+_entries = collections.OrderedDict()   # username -> _Entry, oldest first
+_by_author = {}                        # author -> usernames whose page draws on them
+_by_post = {}                          # post_id -> usernames whose page shows it
+_size = 0
+
+# Bumped on every invalidation; a page computed before an invalidation
+# must not be stored afterwards
+_generation = 0
+
+_Entry = collections.namedtuple('_Entry', 'limit page authors post_ids size')
+
+metrics.register_gauge('feed_cache.bytes', lambda: _size)
+metrics.register_gauge('feed_cache.users', lambda: len(_entries))
+
+
+def generation():
+    """Take this before building a page and pass it to put()."""
+    return _generation
+
+
+def get(username, limit):
+    """The cached (posts, next_cursor) for the user's first page, or None."""
+    with _lock:
+        entry = _entries.get(username)
+        if entry is None or entry.limit != limit:
+            metrics.incr('feed_cache.misses')
+            return None
+        _entries.move_to_end(username)
+    metrics.incr('feed_cache.hits')
+    return entry.page
+
+
+def put(user, limit, page, built_at, following):
+    """
+    Stores a first page built from the data as of generation `built_at`;
+    `following` names the authors the user follows.
+    """
+    global _size
+    posts = page[0]
+    size = len(json.dumps(posts, default=str))
+    if size > helpers.FEED_CACHE_BYTES:
+        return
+
+    username = user['username']
+    authors = set(following) | {username}
+    entry = _Entry(limit, page, authors, {post.doc_id for post in posts}, size)
+
+    with _lock:
+        if built_at != _generation:
+            return
+        _drop(username)
+        _entries[username] = entry
+        _size += size
+        for author in entry.authors:
+            _by_author.setdefault(author, set()).add(username)
+        for post_id in entry.post_ids:
+            _by_post.setdefault(post_id, set()).add(username)
+
+        while _size > helpers.FEED_CACHE_BYTES:
+            _drop(next(iter(_entries)))
+            metrics.incr('feed_cache.evictions')
+
+
+def first_page(db, user, limit, build):
+    """The user's cached first page, or build() stored and returned on a miss."""
+    page = get(user['username'], limit)
+    if page is None:
+        built_at = generation()
+        page = build()
+        put(user, limit, page, built_at, users.get_following_names(db, user['username']))
+    return page
+
+
+def post_added(author):
+    _invalidate(lambda: _by_author.get(author, ()))
+
+
+def post_changed(post_id):
+    _invalidate(lambda: _by_post.get(post_id, ()))
+
+
+def feed_changed(username):
+    _invalidate(lambda: (username,))
+
+
+def clear():
+    with _lock:
+        for username in list(_entries):
+            _drop(username)
+
+
+def _invalidate(affected):
+    global _generation
+    with _lock:
+        _generation += 1
+        usernames = list(affected())
+        for username in usernames:
+            _drop(username)
+    if usernames:
+        metrics.incr('feed_cache.invalidations', len(usernames))
+
+
+def _drop(username):
+    """Removes one entry and its reverse-index links. Caller holds _lock."""
+    global _size
+    entry = _entries.pop(username, None)
+    if entry is None:
+        return
+    _size -= entry.size
+    for index, keys in ((_by_author, entry.authors), (_by_post, entry.post_ids)):
+        for key in keys:
+            usernames = index.get(key)
+            if usernames is not None:
+                usernames.discard(username)
+                if not usernames:
+                    del index[key]
@@ -0,0 +1,193 @@
+import weakref
+
+from db import timelines, users
+from db.tables import DB_LOCK
+
+# In-memory follow graph, so relationship queries don't look anyone up by
+# name or compare follower lists.
+#
+# Each user is a node keyed by their integer ID (doc_id / row id). Their
+# edges are split three ways and kept split as follows come and go:
+#
+#   mutual[id]         - people they follow who follow them back ("friends")
+#   following_only[id] - people they follow who don't follow back
+#   followers_only[id] - people following them whom they don't follow
+#
+# so each of the friends page lists is a copy of one set, O(result).
+# `celebrities` holds the IDs with enough followers for timelines.is_celebrity,
+# updated as follows cross the threshold, so a feed read can find the
+# celebrities someone follows without looking up each person they follow.
+#
+# Each database gets its own graph, built from its follows on first use and
+# kept current by users.new_user / delete_user / follow_user / unfollow_user
+# (both backends).
+
+# The database lock, not one of its own: users.follow_user and friends
+# update this while holding DB_LOCK, and building it reads the database
+_lock = DB_LOCK
+_graphs = weakref.WeakKeyDictionary()   # db -> SocialGraph
+
+
+class SocialGraph:
+
+    def __init__(self, user_docs=(), edges=()):
+        self.ids = {}      # username -> id
+        self.names = {}    # id -> username
+        self.mutual = {}
+        self.following_only = {}
+        self.followers_only = {}
+        self.celebrities = set()
+
+        for doc in user_docs:
+            self.add_user(doc.doc_id, doc['username'])
+        for follower, followee in edges:
+            if follower in self.ids and followee in self.ids:
+                self.follow(self.ids[follower], self.ids[followee])
+
+    def add_user(self, user_id, username):
+        self.ids[username] = user_id
+        self.names[user_id] = username
+        self.mutual[user_id] = set()
+        self.following_only[user_id] = set()
+        self.followers_only[user_id] = set()
+
+    def remove_user(self, user_id):
+        for other in list(self.mutual[user_id]) + list(self.following_only[user_id]):
+            self.unfollow(user_id, other)
+        for other in list(self.followers_only[user_id]):
+            self.unfollow(other, user_id)
+        del self.ids[self.names.pop(user_id)]
+        del self.mutual[user_id], self.following_only[user_id], self.followers_only[user_id]
+        self.celebrities.discard(user_id)
+
+    def follower_count(self, user_id):
+        return len(self.mutual[user_id]) + len(self.followers_only[user_id])
+
+    def update_celebrity(self, user_id):
+        if timelines.is_celebrity(self.follower_count(user_id)):
+            self.celebrities.add(user_id)
+        else:
+            self.celebrities.discard(user_id)
+
+    def follows(self, follower_id, followee_id):
+        return followee_id in self.mutual[follower_id] or followee_id in self.following_only[follower_id]
+
+    def follow(self, follower_id, followee_id):
+        """Adds the edge. Returns False if it was already there."""
+        if self.follows(follower_id, followee_id):
+            return False
+        if follower_id in self.following_only[followee_id]:
+            # Following back: both sides become mutual
+            self.following_only[followee_id].discard(follower_id)
+            self.followers_only[follower_id].discard(followee_id)
+            self.mutual[followee_id].add(follower_id)
+            self.mutual[follower_id].add(followee_id)
+        else:
+            self.following_only[follower_id].add(followee_id)
+            self.followers_only[followee_id].add(follower_id)
+        self.update_celebrity(followee_id)
+        return True
+
+    def unfollow(self, follower_id, followee_id):
+        """Removes the edge. Returns False if it wasn't there."""
+        if followee_id in self.mutual[follower_id]:
+            # The other direction survives as a one-way follow
+            self.mutual[follower_id].discard(followee_id)
+            self.mutual[followee_id].discard(follower_id)
+            self.following_only[followee_id].add(follower_id)
+            self.followers_only[follower_id].add(followee_id)
+        elif followee_id in self.following_only[follower_id]:
+            self.following_only[follower_id].discard(followee_id)
+            self.followers_only[followee_id].discard(follower_id)
+        else:
+            return False
+        self.update_celebrity(followee_id)
+        return True
+
+
+def _for_db(db):
+    """The graph for `db`, built from its users and follows the first time. Caller holds _lock."""
+    graph = _graphs.get(db)
+    if graph is None:
+        graph = _graphs[db] = SocialGraph(users.get_all_users(db), users.get_follow_edges(db))
+    return graph
+
+
+def follows(db, follower_id, followee_id):
+    with _lock:
+        graph = _for_db(db)
+        return follower_id in graph.names and followee_id in graph.names \
+            and graph.follows(follower_id, followee_id)
+
+
+def mutuals(db, user_id):
+    """IDs of the people `user_id` follows who follow them back."""
+    with _lock:
+        return list(_for_db(db).mutual.get(user_id, ()))
+
+
+def following_only(db, user_id):
+    """IDs of the people `user_id` follows who don't follow back."""
+    with _lock:
+        return list(_for_db(db).following_only.get(user_id, ()))
+
+
+def followers_only(db, user_id):
+    """IDs of the people following `user_id` whom they don't follow back."""
+    with _lock:
+        return list(_for_db(db).followers_only.get(user_id, ()))
+
+
+def celebrities_followed(db, user_id):
+    """Usernames of the celebrities among `user_id` and the people they follow."""
+    with _lock:
+        graph = _for_db(db)
+        if user_id not in graph.names:
+            return []
+        return [graph.names[celebrity] for celebrity in graph.celebrities
+                if celebrity == user_id or graph.follows(user_id, celebrity)]
+
+
+def relationship_counts(db, user_id):
+    with _lock:
+        graph = _for_db(db)
+        return {
+            'friends': len(graph.mutual.get(user_id, ())),
+            'following': len(graph.following_only.get(user_id, ())),
+            'followers': len(graph.followers_only.get(user_id, ())),
+        }
+
+
+def usernames(db, user_ids):
+    """The usernames for `user_ids`, in the same order."""
+    with _lock:
+        graph = _for_db(db)
+        return [graph.names[user_id] for user_id in user_ids if user_id in graph.names]
+
+
+def user_added(db, user_id, username):
+    with _lock:
+        graph = _graphs.get(db)
+        if graph is not None:
+            graph.add_user(user_id, username)
+
+
+def user_removed(db, user_id):
+    with _lock:
+        graph = _graphs.get(db)
+        if graph is not None and user_id in graph.names:
+            graph.remove_user(user_id)
+
+
+def followed(db, follower_id, followee_id):
+    with _lock:
+        graph = _graphs.get(db)
+        if graph is not None:
+            graph.follow(follower_id, followee_id)
+
+
+def unfollowed(db, follower_id, followee_id):
+    with _lock:
+        graph = _graphs.get(db)
+        if graph is not None:
+            graph.unfollow(follower_id, followee_id)
@@ -1,6 +1,157 @@
-import tinydb
+import atexit
+import functools
+import importlib
+import os
+import sys
+
+import flask
 # IMPORTANT: Import Query to ensure the environment for TinyDB is fully set up
-from tinydb import Query 
+from tinydb import Query
+
+from db.sqlite_store import SqliteDB
+from db.storage import WALStorage, WriteBehindJSONStorage
+# DB_LOCK is re-exported: db/ functions use helpers.DB_LOCK around
+# read-modify-write sequences
+from db.tables import DB_LOCK, SharedTinyDB, WALTinyDB
+
+# --- Configuration ---
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.environ.get('YOUFACE_DB_PATH', os.path.join(PROJECT_ROOT, 'db.json'))
+
+# Group commit: db.json is rewritten at most once per interval, or as soon
+# as this many writes are buffered
+DB_FLUSH_INTERVAL = float(os.environ.get('YOUFACE_DB_FLUSH_INTERVAL', 1.0))
+DB_FLUSH_EVERY = int(os.environ.get('YOUFACE_DB_FLUSH_EVERY', 100))
+
+# 'json' rewrites db.json (group-committed); 'wal' appends each change to
+# db.json.wal and compacts it into db.json every DB_WAL_COMPACT_EVERY records;
+# 'sqlite' swaps TinyDB for the SQLite database at DB_SQLITE_PATH
+DB_STORAGE = os.environ.get('YOUFACE_DB_STORAGE', 'json')
+DB_SQLITE_PATH = os.environ.get('YOUFACE_DB_SQLITE_PATH', os.path.join(PROJECT_ROOT, 'youface.db'))
+DB_WAL_COMPACT_EVERY = int(os.environ.get('YOUFACE_DB_WAL_COMPACT_EVERY', 1000))
+
+# Authors with at least this many followers are not fanned out on write;
+# their posts are merged into each reader's timeline at read time instead
+CELEBRITY_FOLLOWERS = int(os.environ.get('YOUFACE_CELEBRITY_FOLLOWERS', 10000))
+
+# Memory budget for cached first feed pages (estimated bytes); 0 disables it
+FEED_CACHE_BYTES = int(os.environ.get('YOUFACE_FEED_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Processes used to score follow suggestions (python -m db.recommendations)
+RECOMMEND_WORKERS = int(os.environ.get('YOUFACE_RECOMMEND_WORKERS', os.cpu_count() or 1))
+
+# Seconds between the server's follow suggestion refreshes; 0 disables them
+RECOMMEND_INTERVAL = float(os.environ.get('YOUFACE_RECOMMEND_INTERVAL', 24 * 60 * 60))
+
+# Open handles, keyed by absolute path
+_handles = {}
+
+
+def dispatch(func):
+    """
+    Marks a db/ function as having a SQLite twin. When it is called with a
+    SqliteDB handle, the same-named function in db/sqlite_<module>.py runs
+    instead, so callers never need to know which backend is configured.
+    """
+    module = func.__module__
+    if module == '__main__':
+        # Defined by a module run as `python -m db.<module>`
+        module = sys.modules['__main__'].__spec__.name
+    module_name = 'db.sqlite_' + module.rsplit('.', 1)[-1]
+
+    @functools.wraps(func)
+    def wrapper(db, *args, **kwargs):
+        if isinstance(db, SqliteDB):
+            twin = getattr(importlib.import_module(module_name), func.__name__)
+            return twin(db, *args, **kwargs)
+        return func(db, *args, **kwargs)
+    return wrapper
+
+
+def open_db(path=None, storage=DB_STORAGE, flush_interval=DB_FLUSH_INTERVAL,
+            flush_every=DB_FLUSH_EVERY, compact_every=DB_WAL_COMPACT_EVERY):
+    """Returns the shared handle for `path`, opening it on first use."""
+    if path is None:
+        path = DB_SQLITE_PATH if storage == 'sqlite' else DB_PATH
+    path = os.path.abspath(path)
+    with DB_LOCK:
+        if path in _handles:
+            return _handles[path]
+
+        if storage == 'sqlite':
+            db = SqliteDB(path)
+        elif storage == 'wal':
+            db = WALTinyDB(
+                path,
+                storage=WALStorage,
+                compact_every=compact_every,
+                lock=DB_LOCK,
+            )
+        elif storage == 'json':
+            db = SharedTinyDB(
+                path,
+                storage=WriteBehindJSONStorage,
+                flush_interval=flush_interval,
+                flush_every=flush_every,
+                lock=DB_LOCK,
+            )
+        else:
+            raise ValueError(f"Unknown DB_STORAGE '{storage}'")
+
+        _handles[path] = db
+        return db
+
+
+@atexit.register
+def close_all():
+    """Flushes buffered writes and closes every open handle."""
+    with DB_LOCK:
+        handles = list(_handles.values())
+        _handles.clear()
+    for db in handles:
+        db.close()
+
+
+def init_app(app):
+    """Opens the database once and registers it as an app extension."""
+    app.config.setdefault('DB_PATH', DB_PATH)
+    app.config.setdefault('DB_SQLITE_PATH', DB_SQLITE_PATH)
+    app.config.setdefault('DB_STORAGE', DB_STORAGE)
+    app.config.setdefault('DB_FLUSH_INTERVAL', DB_FLUSH_INTERVAL)
+    app.config.setdefault('DB_FLUSH_EVERY', DB_FLUSH_EVERY)
+    app.config.setdefault('DB_WAL_COMPACT_EVERY', DB_WAL_COMPACT_EVERY)
+    sqlite = app.config['DB_STORAGE'] == 'sqlite'
+    app.extensions['youface_db'] = open_db(
+        app.config['DB_SQLITE_PATH'] if sqlite else app.config['DB_PATH'],
+        storage=app.config['DB_STORAGE'],
+        flush_interval=app.config['DB_FLUSH_INTERVAL'],
+        flush_every=app.config['DB_FLUSH_EVERY'],
+        compact_every=app.config['DB_WAL_COMPACT_EVERY'],
+    )
+
+
+def open_script_db(offline=False):
+    """
+    Opens the configured database for a `python -m db.<module>` script.
+    The json and wal backends keep db.json in the server's memory and
+    rewrite it from there, so anything another process writes to it is
+    lost (and two processes would interleave one WAL). For those the
+    script must be told with `offline` that the server is stopped.
+    """
+    if DB_STORAGE != 'sqlite' and not offline:
+        raise SystemExit(
+            f"The '{DB_STORAGE}' backend can only be written by one process at a time. "
+            "Stop the server and rerun with --offline, or use YOUFACE_DB_STORAGE=sqlite.")
+    return open_db()
+
 
 def load_db():
-    return tinydb.TinyDB('db.json', sort_keys=True, indent=4, separators=(',', ': '))
+    """
+    Returns the long-lived database handle. Inside a request this is the
+    handle registered by init_app, otherwise the process-wide default.
+    """
+    if flask.has_app_context():
+        db = flask.current_app.extensions.get('youface_db')
+        if db is not None:
+            return db
+    return open_db()
@@ -0,0 +1,157 @@
+import bisect
+import math
+
+# Secondary hash indexes kept in memory next to the TinyDB tables.
+#
+# Each entry lists the field combinations indexed for that table. Queries
+# of the form `Q.field == value` (optionally and-ed with anything else)
+# are answered from the index instead of a full table scan.
+INDEXED_FIELDS = {
+    'users': [('username',)],
+    'posts': [('user',)],
+    'likes': [('user_id', 'post_id'), ('post_id',), ('user_id',)],
+    'timelines': [('user',)],
+    'timeline_owners': [('user',)],
+    'comments': [('post_id',)],
+    'search_postings': [('term', 'post_id'), ('term',)],
+    'follows': [('follower', 'followee'), ('follower',), ('followee',)],
+    'recommendations': [('user',)],
+}
+
+
+# Fields kept in sorted order per table, for paging, as (field, partition)
+# pairs. A partition keeps one sorted list per value of that field, e.g.
+# each author's posts by time or each user's followers by name; None is
+# the whole table.
+SORTED_FIELDS = {
+    'posts': [('time', 'user')],
+    'follows': [('follower', 'followee'), ('followee', 'follower')],
+    'timelines': [('time', 'user')],
+    'comments': [('time', 'post_id')],
+}
+
+
+class HashIndex:
+    """Maps a tuple of field values to the set of doc_ids holding them."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.entries = {}   # key -> set of doc_ids
+        self.keys = {}      # doc_id -> key, so updates can find the old entry
+
+    def key_for(self, doc):
+        """The index key for `doc`, or None if it can't be indexed."""
+        try:
+            key = tuple(doc[field] for field in self.fields)
+            hash(key)
+        except (KeyError, TypeError):
+            return None
+        return key
+
+    def add(self, doc_id, doc):
+        self.discard(doc_id)
+        key = self.key_for(doc)
+        if key is not None:
+            self.keys[doc_id] = key
+            self.entries.setdefault(key, set()).add(doc_id)
+
+    def discard(self, doc_id):
+        key = self.keys.pop(doc_id, None)
+        if key is not None:
+            doc_ids = self.entries[key]
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self.entries[key]
+
+    def lookup(self, key):
+        return self.entries.get(key, set())
+
+
+class SortedIndex:
+    """
+    Keeps (value, doc_id) pairs for one field in bisect-backed sorted
+    lists, so "the newest k before X" is a binary search plus k steps.
+    With a `partition` field there is one list per value of it.
+    """
+
+    def __init__(self, field, partition=None):
+        self.field = field
+        self.partition = partition
+        self.lists = {}     # partition value (None if unpartitioned) -> sorted (value, int doc_id)
+        self.keys = {}      # doc_id -> (partition value, entry)
+
+    def add(self, doc_id, doc):
+        self.discard(doc_id)
+        value = doc.get(self.field)
+        group = None if self.partition is None else doc.get(self.partition)
+        if value is None or (self.partition is not None and group is None):
+            return
+        try:
+            hash(group)
+        except TypeError:
+            return
+        entry = (value, int(doc_id))
+        self.keys[doc_id] = (group, entry)
+        bisect.insort(self.lists.setdefault(group, []), entry)
+
+    def discard(self, doc_id):
+        found = self.keys.pop(doc_id, None)
+        if found is not None:
+            group, entry = found
+            entries = self.lists[group]
+            del entries[bisect.bisect_left(entries, entry)]
+            if not entries:
+                del self.lists[group]
+
+    def descending(self, before=None, group=None):
+        """
+        Yields doc_ids from the highest value down, strictly below `before`,
+        from the list for `group` (leave it None when unpartitioned).
+        """
+        entries = self.lists.get(group, [])
+        end = len(entries) if before is None else bisect.bisect_left(entries, tuple(before))
+        for position in range(end - 1, -1, -1):
+            yield entries[position][1]
+
+    def ascending(self, after=None, group=None):
+        """
+        Yields doc_ids from the lowest value up, strictly above `after`,
+        from the list for `group` (leave it None when unpartitioned).
+        `after` is a value, or a (value, doc_id) tuple cursor to resume
+        within a run of equal values.
+        """
+        entries = self.lists.get(group, [])
+        if after is None:
+            start = 0
+        elif isinstance(after, tuple):
+            start = bisect.bisect_right(entries, after)
+        else:
+            start = bisect.bisect_right(entries, (after, math.inf))
+        for position in range(start, len(entries)):
+            yield entries[position][1]
+
+
+def equality_terms(query_hash):
+    """
+    Pulls the `field == value` conditions a query requires out of its
+    TinyDB hash, e.g. (User.username == 'a') & (User.password == 'b')
+    gives {'username': 'a', 'password': 'b'}. Anything that isn't a plain
+    equality (or an `and` of them) contributes nothing, and neither does
+    comparing with a list or dict: TinyDB freezes those into tuples and
+    frozen dicts, which never match the unhashable stored values the
+    index leaves out.
+    """
+    if not query_hash:
+        return {}
+
+    operator = query_hash[0]
+    if operator == '==' and len(query_hash[1]) == 1 and isinstance(query_hash[1][0], str):
+        if isinstance(query_hash[2], (tuple, dict, frozenset)):
+            return {}
+        return {query_hash[1][0]: query_hash[2]}
+    if operator == 'and':
+        terms = {}
+        for part in query_hash[1]:
+            terms.update(equality_terms(part))
+        return terms
+    return {}
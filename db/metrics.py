@@ -0,0 +1,50 @@
+import threading
+
+# In-process metrics, readable as JSON at /metrics.
+#
+# Counters only go up. Observations keep count/total/max so averages can
+# be derived. Gauges are functions evaluated when a snapshot is taken, so
+# they always report the current value of a setting.
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+_gauges = {}
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    with _lock:
+        stats = _observations.setdefault(name, {'count': 0, 'total': 0, 'max': 0})
+        stats['count'] += 1
+        stats['total'] += value
+        stats['max'] = max(stats['max'], value)
+
+
+def register_gauge(name, func):
+    with _lock:
+        _gauges[name] = func
+
+
+def snapshot():
+    """A copy of every metric, safe to serialize."""
+    with _lock:
+        counters = dict(_counters)
+        observations = {name: dict(stats) for name, stats in _observations.items()}
+        gauges = dict(_gauges)
+    return {
+        'counters': counters,
+        'observations': observations,
+        'gauges': {name: func() for name, func in gauges.items()},
+    }
+
+
+def reset():
+    """Clears counters and observations (gauges stay registered)."""
+    with _lock:
+        _counters.clear()
+        _observations.clear()
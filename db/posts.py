@@ -1,104 +1,245 @@
+import collections
 import time
+
 import tinydb
+from tinydb.operations import delete
+from tinydb.table import Document
+
+from db import feed_cache, helpers, search, timelines
 
 # Use the TinyDB Query object for filtering
 Post = tinydb.Query()
 Like = tinydb.Query()
 
+@helpers.dispatch
 def add_post(db, user, text):
-    """Creates a new post in the 'posts' table."""
+    """Creates a new post in the 'posts' table and fans it out to followers."""
+    text = text or ''
     posts_table = db.table('posts')
-    posts_table.insert({
+    post_time = time.time()
+    post_id = posts_table.insert({
         'user': user['username'], 
         'text': text, 
-        'time': time.time(),
-        'user_id': user.doc_id  # store user doc_id for easy lookup
+        'time': post_time,
+        'user_id': user.doc_id,  # store user doc_id for easy lookup
+        'like_count': 0,
+        'comment_count': 0
     })
 
-def get_posts(db, user):
-    """Retrieves all non-empty posts for a specific user."""
-    posts_table = db.table('posts')
-    target_username = user.get('username')
-
-    if not target_username:
-        return []
-    
-    user_posts = posts_table.search(
-        (Post.user == target_username) & 
-        (Post.text != '')
-    )
-    
-    return user_posts
-
-def get_all_valid_posts(db, current_user_id=None):
-    """Retrieves all valid (non-empty) posts and adds like info."""
-    posts_table = db.table('posts')
-    likes_table = db.table('likes')
+    # Empty posts never show up in a feed, so they aren't fanned out
+    if text:
+        timelines.fan_out_post(db, user, post_id, post_time)
+        search.index_text(db, post_id, text)
+        feed_cache.post_added(user['username'])
+    return post_id
 
-    all_valid_posts = posts_table.search(Post.text != '')
-
-    for post in all_valid_posts:
-        post_id = post.doc_id
-
-        # Total likes for this post
-        post['like_count'] = len(likes_table.search(Like.post_id == post_id))
+@helpers.dispatch
+def get_recent_posts(db, username, limit=None, before=None):
+    """
+    Retrieves a user's non-empty posts newest first (up to `limit`,
+    strictly before the (time, doc_id) cursor `before`), straight from
+    the per-author time index.
+    """
+    return db.table('posts').newest(
+        'time', limit, before=before, cond=Post.text != '', partition=('user', username))
+
+@helpers.dispatch
+def get_post(db, post_id):
+    """Retrieves one post by its doc_id, or None."""
+    return db.table('posts').get(doc_id=post_id)
+
+@helpers.dispatch
+def get_all_posts(db):
+    """Retrieves every post, including empty ones."""
+    return db.table('posts').all()
+
+def encode_cursor(cursor):
+    """Turns a (time, doc_id) cursor into a 'time_docid' URL parameter."""
+    post_time, doc_id = cursor
+    return f"{post_time!r}_{doc_id}"
+
+def decode_cursor(cursor):
+    """Parses a cursor from encode_cursor; returns None if it is malformed."""
+    try:
+        post_time, doc_id = cursor.split('_')
+        return float(post_time), int(doc_id)
+    except (AttributeError, ValueError):
+        return None
+
+@helpers.dispatch
+def get_timeline_page(db, user, before=None, limit=20):
+    """
+    Retrieves one page of the user's home timeline (their own posts and
+    posts by people they follow), newest first, with like info.
+    Returns (posts, next_cursor); next_cursor is None on the last page.
+    """
+    posts_table = db.table('posts')
 
-        # Check if current user liked this post
-        post['liked_by_user'] = False
-        if current_user_id is not None:
-            like_record = likes_table.get(
-                (Like.user_id == current_user_id) & (Like.post_id == post_id)
-            )
-            if like_record:
-                post['liked_by_user'] = True
+    entries, next_cursor = timelines.read_timeline(db, user, before=before, limit=limit)
+    page = [post for post in (posts_table.get(doc_id=post_id) for _, post_id in entries) if post]
+    return _with_like_info(db, page, user.doc_id), next_cursor
 
-    # Sort newest first
-    all_valid_posts.sort(key=lambda p: p['time'], reverse=True)
-    return all_valid_posts
+def _with_like_info(db, page, current_user_id):
+    """Copies of `page` with counters and the user's liked flag, via the likes index."""
+    likes_table = db.table('likes')
 
+    feed_posts = []
+    for post in page:
+        liked = current_user_id is not None and likes_table.contains(
+            (Like.user_id == current_user_id) & (Like.post_id == post.doc_id)
+        )
+        feed_posts.append(Document(
+            dict(post,
+                 like_count=post.get('like_count', 0),
+                 comment_count=post.get('comment_count', 0),
+                 liked_by_user=liked),
+            post.doc_id))
+    return feed_posts
+
+def _adjust_counter(field, delta):
+    """A TinyDB update transform that moves a post's counter by `delta`."""
+    def transform(doc):
+        doc[field] = max(doc.get(field, 0) + delta, 0)
+    return transform
+
+@helpers.dispatch
 def like_post(db, user_id, post_id):
-    """Adds a like from a user to a post."""
+    """Adds a like from a user to a post and bumps the post's like_count."""
+    posts_table = db.table('posts')
     likes_table = db.table('likes')
-    existing_like = likes_table.get(
-        (Like.user_id == user_id) & (Like.post_id == post_id)
-    )
-    if not existing_like:
-        likes_table.insert({
-            'user_id': user_id,
-            'post_id': post_id,
-            'time': time.time()
-        })
-        return True
+
+    # The like and its counter change together or not at all
+    with helpers.DB_LOCK:
+        if not posts_table.contains(doc_id=post_id):
+            return False
+
+        existing_like = likes_table.get(
+            (Like.user_id == user_id) & (Like.post_id == post_id)
+        )
+        if not existing_like:
+            likes_table.insert({
+                'user_id': user_id,
+                'post_id': post_id,
+                'time': time.time()
+            })
+            posts_table.update(_adjust_counter('like_count', 1), doc_ids=[post_id])
+            feed_cache.post_changed(post_id)
+            return True
     return False
 
+@helpers.dispatch
 def unlike_post(db, user_id, post_id):
-    """Removes a like."""
+    """Removes a like and lowers the post's like_count."""
+    posts_table = db.table('posts')
     likes_table = db.table('likes')
-    delete_count = likes_table.remove(
-        (Like.user_id == user_id) & (Like.post_id == post_id)
-    )
-    return delete_count > 0
 
+    with helpers.DB_LOCK:
+        removed = likes_table.remove(
+            (Like.user_id == user_id) & (Like.post_id == post_id)
+        )
+        if removed and posts_table.contains(doc_id=post_id):
+            posts_table.update(_adjust_counter('like_count', -len(removed)), doc_ids=[post_id])
+            feed_cache.post_changed(post_id)
+    return len(removed) > 0
+
+@helpers.dispatch
+def get_like_state(db, user_id, post_id):
+    """
+    (like_count, liked) for a post as the user sees it, from one
+    consistent read of the post and the like, or None if the post is gone.
+    """
+    with helpers.DB_LOCK:
+        post = db.table('posts').get(doc_id=post_id)
+        if not post:
+            return None
+        liked = db.table('likes').contains((Like.user_id == user_id) & (Like.post_id == post_id))
+    return post.get('like_count', 0), liked
+
+@helpers.dispatch
 def add_comment(db, post_id, username, text):
     """
-    Adds a comment to a specific post by its TinyDB doc_id.
+    Adds a comment to a specific post by its TinyDB doc_id. The comment
+    goes into the 'comments' table; the post only has its counter bumped.
     """
     posts_table = db.table('posts')
-    post_record = posts_table.get(doc_id=post_id)
+    comments_table = db.table('comments')
+
+    with helpers.DB_LOCK:
+        if not posts_table.contains(doc_id=post_id):
+            return None
 
-    if post_record:
         new_comment = {
             'user': username,
             'text': text,
             'time': time.time()
         }
+        comments_table.insert(dict(new_comment, post_id=post_id))
+        posts_table.update(_adjust_counter('comment_count', 1), doc_ids=[post_id])
+        search.index_text(db, post_id, text)
+        feed_cache.post_changed(post_id)
+
+    return new_comment
+
+@helpers.dispatch
+def get_comments_page(db, post_id, after=None, limit=20):
+    """
+    Retrieves one page of a post's comments, oldest first. `after` is a
+    (time, doc_id) cursor: the page starts strictly after it.
+    Returns (comments, next_cursor); next_cursor is None on the last page.
+    """
+    # One more than a page tells us if there's a next page
+    comments = db.table('comments').ascending(
+        'time', limit + 1, after=None if after is None else tuple(after),
+        partition=('post_id', post_id))
+
+    page = comments[:limit]
+    next_cursor = (page[-1]['time'], page[-1].doc_id) if len(comments) > limit else None
+    return page, next_cursor
+
+@helpers.dispatch
+def move_embedded_comments(db):
+    """
+    Moves comments stored inside post documents (the old layout) into the
+    'comments' table. Returns how many posts were migrated.
+    """
+    posts_table = db.table('posts')
+    comments_table = db.table('comments')
+
+    with helpers.DB_LOCK:
+        posts = posts_table.search(Post.comments.exists())
+        comments_table.insert_multiple(
+            dict(comment, post_id=post.doc_id)
+            for post in posts
+            for comment in post['comments']
+        )
+        if posts:
+            posts_table.update(delete('comments'), doc_ids=[post.doc_id for post in posts])
+
+    return len(posts)
+
+@helpers.dispatch
+def backfill_post_counters(db):
+    """
+    Recomputes like_count and comment_count on every post from the likes
+    and comments tables. Returns how many posts changed.
+    """
+    posts_table = db.table('posts')
+    likes_table = db.table('likes')
+    comments_table = db.table('comments')
+
+    with helpers.DB_LOCK:
+        like_counts = collections.Counter(like['post_id'] for like in likes_table)
+        comment_counts = collections.Counter(comment['post_id'] for comment in comments_table)
 
-        if 'comments' not in post_record:
-            post_record['comments'] = []
+        # Group posts by their correct counter values so each distinct pair
+        # costs one table update instead of one update per post
+        stale = collections.defaultdict(list)
+        for post in posts_table:
+            counters = (like_counts[post.doc_id], comment_counts[post.doc_id])
+            if (post.get('like_count'), post.get('comment_count')) != counters:
+                stale[counters].append(post.doc_id)
 
-        post_record['comments'].append(new_comment)
-        posts_table.update(post_record, doc_ids=[post_id])
+        for (like_count, comment_count), doc_ids in stale.items():
+            posts_table.update({'like_count': like_count, 'comment_count': comment_count}, doc_ids=doc_ids)
 
-        return new_comment
-    
-    return None
+    return sum(len(doc_ids) for doc_ids in stale.values())
@@ -0,0 +1,228 @@
+"""
+Follow suggestions, computed in batch and stored per user so the friends
+page reads them with one lookup.
+
+A candidate is anyone the user doesn't follow yet. They score for:
+
+  - each person the user follows who follows them (friends of friends)
+  - each of the user's followers who also follows them
+  - following the user already
+  - popularity, on a log scale so big accounts don't drown out the rest
+
+The scoring runs in a process pool over chunks of users. The server
+recomputes the stored suggestions in a background thread every
+helpers.RECOMMEND_INTERVAL seconds (youface.py calls start_refresher once
+it knows it is the process serving requests). To recompute
+them by hand from the project root:
+
+    python -m db.recommendations
+
+With the json and wal backends only one process may write db.json, so
+that needs the server stopped and --offline.
+"""
+import argparse
+import concurrent.futures
+import heapq
+import math
+import multiprocessing
+import threading
+import time
+import traceback
+
+import tinydb
+
+from db import helpers, metrics, users
+
+SUGGESTIONS_PER_USER = 10
+
+FRIEND_OF_FRIEND_WEIGHT = 3.0
+SHARED_FOLLOWER_WEIGHT = 1.0
+FOLLOWS_YOU_WEIGHT = 5.0
+POPULARITY_WEIGHT = 0.5
+
+# People who follow more than this many accounts say little about any one
+# of them, and walking their lists would dominate the batch; skip them as
+# a second hop
+MAX_HOP_FOLLOWING = 1000
+
+# How many of the most followed accounts to keep for topping up short lists
+POPULAR_FALLBACK = 100
+
+Suggestion = tinydb.Query()
+
+# One background refresher per handle, started by start_refresher
+_lock = threading.Lock()
+_refreshers = {}   # db -> threading.Thread
+
+# Set in each worker process by _init_worker
+_following = None
+_followers = None
+_follower_counts = None
+_popular = None
+
+
+def _init_worker(following, followers, follower_counts, popular):
+    global _following, _followers, _follower_counts, _popular
+    _following, _followers, _follower_counts, _popular = following, followers, follower_counts, popular
+
+
+def _suggest(username):
+    """The best SUGGESTIONS_PER_USER (candidate, score) pairs for one user."""
+    following = _following.get(username, set())
+    followers = _followers.get(username, set())
+    skip = following | {username}
+
+    scores = {}
+    for hops, weight in ((following, FRIEND_OF_FRIEND_WEIGHT), (followers, SHARED_FOLLOWER_WEIGHT)):
+        for middle in hops:
+            their_following = _following.get(middle, ())
+            if len(their_following) > MAX_HOP_FOLLOWING:
+                continue
+            for candidate in their_following:
+                if candidate not in skip:
+                    scores[candidate] = scores.get(candidate, 0) + weight
+    for candidate in followers - skip:
+        scores[candidate] = scores.get(candidate, 0) + FOLLOWS_YOU_WEIGHT
+
+    # Nobody nearby: fall back to the most followed accounts
+    for candidate in _popular:
+        if len(scores) >= SUGGESTIONS_PER_USER:
+            break
+        if candidate not in skip:
+            scores.setdefault(candidate, 0)
+
+    ranked = sorted(
+        ((score + POPULARITY_WEIGHT * math.log1p(_follower_counts.get(candidate, 0)), candidate)
+         for candidate, score in scores.items()),
+        key=lambda pair: (-pair[0], pair[1]))
+    return [(candidate, round(score, 3)) for score, candidate in ranked[:SUGGESTIONS_PER_USER]]
+
+
+def _suggest_chunk(usernames):
+    return [(username, _suggest(username)) for username in usernames]
+
+
+def compute_suggestions(db, workers=None, chunk_size=500):
+    """
+    Scores suggestions for every user across `workers` processes (default
+    helpers.RECOMMEND_WORKERS). Returns {username: [(candidate, score), ...]}.
+    """
+    # Writers update the table dicts in place; snapshot them in one go
+    with helpers.DB_LOCK:
+        usernames = [user['username'] for user in users.get_all_users(db)]
+        edges = users.get_follow_edges(db)
+
+    following, followers = {}, {}
+    for follower, followee in edges:
+        following.setdefault(follower, set()).add(followee)
+        followers.setdefault(followee, set()).add(follower)
+    follower_counts = {name: len(names) for name, names in followers.items()}
+    popular = heapq.nsmallest(POPULAR_FALLBACK, usernames,
+                              key=lambda name: (-follower_counts.get(name, 0), name))
+
+    chunks = [usernames[i:i + chunk_size] for i in range(0, len(usernames), chunk_size)]
+    # Spawned, not forked: the server's request threads may hold locks
+    # that a forked child would inherit locked
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers or helpers.RECOMMEND_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(following, followers, follower_counts, popular)) as pool:
+        return dict(pair for chunk in pool.map(_suggest_chunk, chunks) for pair in chunk)
+
+
+@helpers.dispatch
+def store_suggestions(db, suggestions, computed_at=None):
+    """
+    Replaces every stored suggestion list with `suggestions` in one write,
+    and records when the batch was computed in 'recommendations_meta'.
+    """
+    computed_at = computed_at or time.time()
+    table = db.table('recommendations')
+    meta = db.table('recommendations_meta')
+    with helpers.DB_LOCK:
+        table.truncate()
+        table.insert_multiple(
+            {'user': username, 'suggestions': [list(pair) for pair in pairs], 'computed_at': computed_at}
+            for username, pairs in suggestions.items()
+        )
+        meta.truncate()
+        meta.insert({'computed_at': computed_at})
+
+
+@helpers.dispatch
+def last_computed(db):
+    """When the stored suggestions were computed, or None if they never were."""
+    meta = db.table('recommendations_meta').all()
+    return meta[0]['computed_at'] if meta else None
+
+
+@helpers.dispatch
+def get_suggestions(db, username):
+    """The stored [(candidate, score), ...] for a user, best first, or None if never computed."""
+    doc = db.table('recommendations').get(Suggestion.user == username)
+    return [tuple(pair) for pair in doc['suggestions']] if doc else None
+
+
+def suggested_users(db, user, following_names, limit=5):
+    """
+    User docs for the best `limit` stored suggestions for `user`, leaving
+    out anyone they've followed since. Users without stored suggestions
+    (none computed yet, or new since the last batch) get
+    users.get_potential_friends instead.
+    """
+    suggestions = get_suggestions(db, user['username'])
+    if not suggestions:
+        return users.get_potential_friends(db, user, limit=limit)
+    names = [name for name, _ in suggestions if name not in following_names]
+    return users.get_users_by_names(db, names[:limit])
+
+
+def refresh(db, workers=None):
+    """Recomputes and stores everyone's suggestions. Returns how many users got some."""
+    suggestions = compute_suggestions(db, workers)
+    store_suggestions(db, suggestions)
+    return sum(1 for pairs in suggestions.values() if pairs)
+
+
+def start_refresher(db, interval=None):
+    """
+    Starts a daemon thread that refreshes `db`'s suggestions every
+    `interval` seconds (default helpers.RECOMMEND_INTERVAL; 0 disables
+    it), the first time once the stored batch is that old. Only the
+    first call per handle starts one. Call it only from the process
+    serving requests: with the json and wal backends that process owns
+    db.json.
+    """
+    interval = helpers.RECOMMEND_INTERVAL if interval is None else interval
+    if interval <= 0 or db in _refreshers:
+        return
+    with _lock:
+        if db not in _refreshers:
+            _refreshers[db] = threading.Thread(
+                target=_refresh_loop, args=(db, interval), name='recommendations', daemon=True)
+            _refreshers[db].start()
+
+
+def _refresh_loop(db, interval):
+    due = (last_computed(db) or 0) + interval
+    while True:
+        time.sleep(max(due - time.time(), 0))
+        try:
+            refresh(db)
+            metrics.incr('recommendations.refreshes')
+        except Exception:
+            # Keep the old suggestions and try again next interval
+            metrics.incr('recommendations.refresh_failures')
+            traceback.print_exc()
+        due = time.time() + interval
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute everyone's follow suggestions.")
+    parser.add_argument('--offline', action='store_true',
+                        help='the server is stopped (required unless the backend is sqlite)')
+    args = parser.parse_args()
+    started = time.perf_counter()
+    count = refresh(helpers.open_script_db(args.offline))
+    print(f"Stored suggestions for {count} users in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,154 @@
+"""
+Full-text search over posts (and the comments on them) through an
+inverted index: for each term, the posts containing it and how often.
+
+add_post and add_comment index their text as they write it, and the
+server indexes existing posts on startup if the index is empty. To
+rebuild it from the project root (with the json and wal backends, only
+while the server is stopped):
+
+    python -m db.search [--offline]
+"""
+import argparse
+import collections
+import math
+import re
+
+import tinydb
+
+from db import helpers
+
+# One posting document per (term, post) pair, like SQLite's post_terms:
+# {'term': 'hello', 'post_id': 3, 'count': 2}. Indexing a post only adds
+# or bumps its own postings, however common its words are.
+Posting = tinydb.Query()
+Post = tinydb.Query()
+
+_WORD = re.compile(r"\w+")
+
+# Too common to say anything about a post
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its me my no
+not of on or so that the this to was we were what with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased words of two or more characters, minus stopwords."""
+    return [word for word in _WORD.findall(text.lower())
+            if len(word) > 1 and word not in STOPWORDS]
+
+
+def term_counts(text):
+    return collections.Counter(tokenize(text))
+
+
+def idf(total_posts, document_frequency):
+    """Rarer terms count for more: log(1 + N / df)."""
+    return math.log(1 + total_posts / document_frequency)
+
+
+def _add_counts(counts):
+    """A TinyDB update transform adding {(term, post_id): count} to postings."""
+    def transform(doc):
+        doc['count'] += counts[doc['term'], doc['post_id']]
+    return transform
+
+
+def _index_many(db, items):
+    """Indexes (post_id, text) pairs with one update and one insert."""
+    postings_table = db.table('search_postings')
+
+    counts = collections.Counter()
+    for post_id, text in items:
+        for term, count in term_counts(text).items():
+            counts[term, post_id] += count
+    if not counts:
+        return
+
+    with helpers.DB_LOCK:
+        # A comment adds to the postings its post already has
+        existing = {}
+        for term, post_id in counts:
+            doc = postings_table.get((Posting.term == term) & (Posting.post_id == post_id))
+            if doc:
+                existing[term, post_id] = doc.doc_id
+        if existing:
+            postings_table.update(_add_counts(counts), doc_ids=list(existing.values()))
+
+        postings_table.insert_multiple(
+            {'term': term, 'post_id': post_id, 'count': count}
+            for (term, post_id), count in counts.items() if (term, post_id) not in existing
+        )
+
+
+@helpers.dispatch
+def index_text(db, post_id, text):
+    """Adds `text` (a post's body or one of its comments) to the index."""
+    _index_many(db, [(post_id, text)])
+
+
+@helpers.dispatch
+def search_posts(db, query, page=1, per_page=20):
+    """
+    Posts matching any term of `query`, best first: each post scores the
+    sum over query terms of count x idf, ties going to the newer post.
+    Returns (posts on this page, total number of matches).
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return [], 0
+
+    postings_table = db.table('search_postings')
+    posts_table = db.table('posts')
+
+    with helpers.DB_LOCK:
+        total_posts = max(len(posts_table), 1)
+        scores = collections.Counter()
+        for term in terms:
+            postings = postings_table.search(Posting.term == term)
+            if not postings:
+                continue
+            weight = idf(total_posts, len(postings))
+            for posting in postings:
+                scores[posting['post_id']] += posting['count'] * weight
+
+        ranked = sorted(scores, key=lambda post_id: (scores[post_id], post_id), reverse=True)
+        start = (page - 1) * per_page
+        results = []
+        for post_id in ranked[start:start + per_page]:
+            post = posts_table.get(doc_id=post_id)
+            if post:
+                results.append(post)
+
+    return results, len(ranked)
+
+
+@helpers.dispatch
+def rebuild_index(db):
+    """Re-indexes every post and comment from scratch. Returns posts indexed."""
+    posts_table = db.table('posts')
+    comments_table = db.table('comments')
+
+    with helpers.DB_LOCK:
+        # Term documents from before postings had their own documents
+        db.drop_table('search_terms')
+        db.table('search_postings').truncate()
+        posts = posts_table.search(Post.text != '')
+        _index_many(db, [(post.doc_id, post['text']) for post in posts]
+                    + [(comment['post_id'], comment['text']) for comment in comments_table])
+    return len(posts)
+
+
+@helpers.dispatch
+def index_is_empty(db):
+    return len(db.table('search_postings')) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuilds the post search index.')
+    parser.add_argument('--offline', action='store_true',
+                        help='the server is stopped (required unless the backend is sqlite)')
+    args = parser.parse_args()
+    indexed = rebuild_index(helpers.open_script_db(args.offline))
+    print(f"Indexed {indexed} posts for search")
@@ -0,0 +1,159 @@
+import time
+
+from tinydb.table import Document
+
+from db import feed_cache, sqlite_search, sqlite_timelines
+from db.sqlite_store import BACKFILL_POST_COUNTERS, placeholders
+
+# SQLite twins of the functions in db/posts.py. Post documents are built
+# in the same shape the TinyDB backend stores; comments are fetched
+# separately, a page at a time.
+
+
+def _post_docs(db, rows, extra_fields=()):
+    """Turns post rows into Documents."""
+    docs = []
+    for row in rows:
+        post = {
+            'user': row['user'],
+            'text': row['text'],
+            'time': row['time'],
+            'user_id': row['user_id'],
+            'like_count': row['like_count'],
+            'comment_count': row['comment_count'],
+        }
+        for field in extra_fields:
+            post[field] = row[field]
+        docs.append(Document(post, row['id']))
+    return docs
+
+
+def add_post(db, user, text):
+    text = text or ''
+    post_time = time.time()
+    with db.transaction() as conn:
+        post_id = conn.execute(
+            'INSERT INTO posts (user, user_id, text, time) VALUES (?, ?, ?, ?)',
+            (user['username'], user.doc_id, text, post_time)).lastrowid
+    if text:
+        sqlite_timelines.fan_out_post(db, user, post_id, post_time)
+        sqlite_search.index_text(db, post_id, text)
+        feed_cache.post_added(user['username'])
+    return post_id
+
+
+def get_recent_posts(db, username, limit=None, before=None):
+    sql = "SELECT * FROM posts WHERE user = ? AND text != '' "
+    params = [username]
+    if before is not None:
+        sql += 'AND (time < ? OR (time = ? AND id < ?)) '
+        params += [before[0], before[0], before[1]]
+    sql += 'ORDER BY time DESC, id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return _post_docs(db, db.query(sql, params))
+
+
+def get_post(db, post_id):
+    docs = _post_docs(db, db.query('SELECT * FROM posts WHERE id = ?', (post_id,)))
+    return docs[0] if docs else None
+
+
+def get_all_posts(db):
+    return _post_docs(db, db.query('SELECT * FROM posts ORDER BY id'))
+
+
+def get_timeline_page(db, user, before=None, limit=20):
+    entries, next_cursor = sqlite_timelines.read_timeline(db, user, before=before, limit=limit)
+    post_ids = [post_id for _, post_id in entries]
+    if not post_ids:
+        return [], next_cursor
+
+    rows = db.query(
+        'SELECT p.*, mine.post_id IS NOT NULL AS liked_by_user '
+        'FROM posts p '
+        'LEFT JOIN likes mine ON mine.post_id = p.id AND mine.user_id = ? '
+        f'WHERE p.id IN ({placeholders(post_ids)})',
+        [user.doc_id] + post_ids)
+    by_id = {post.doc_id: post for post in _post_docs(db, rows, extra_fields=('liked_by_user',))}
+
+    posts = [by_id[post_id] for post_id in post_ids if post_id in by_id]
+    for post in posts:
+        post['liked_by_user'] = bool(post['liked_by_user'])
+    return posts, next_cursor
+
+
+def like_post(db, user_id, post_id):
+    with db.transaction() as conn:
+        if not conn.execute('SELECT 1 FROM posts WHERE id = ?', (post_id,)).fetchone():
+            return False
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO likes (user_id, post_id, time) VALUES (?, ?, ?)',
+            (user_id, post_id, time.time()))
+        if cursor.rowcount:
+            conn.execute('UPDATE posts SET like_count = like_count + 1 WHERE id = ?', (post_id,))
+    if cursor.rowcount:
+        feed_cache.post_changed(post_id)
+    return cursor.rowcount > 0
+
+
+def unlike_post(db, user_id, post_id):
+    with db.transaction() as conn:
+        cursor = conn.execute(
+            'DELETE FROM likes WHERE user_id = ? AND post_id = ?',
+            (user_id, post_id))
+        if cursor.rowcount:
+            conn.execute(
+                'UPDATE posts SET like_count = MAX(like_count - 1, 0) WHERE id = ?', (post_id,))
+    if cursor.rowcount:
+        feed_cache.post_changed(post_id)
+    return cursor.rowcount > 0
+
+
+def get_like_state(db, user_id, post_id):
+    rows = db.query(
+        'SELECT like_count, EXISTS (SELECT 1 FROM likes WHERE user_id = ? AND post_id = posts.id) AS liked '
+        'FROM posts WHERE id = ?', (user_id, post_id))
+    return (rows[0]['like_count'], bool(rows[0]['liked'])) if rows else None
+
+
+def add_comment(db, post_id, username, text):
+    new_comment = {'user': username, 'text': text, 'time': time.time()}
+    with db.transaction() as conn:
+        if not conn.execute('SELECT 1 FROM posts WHERE id = ?', (post_id,)).fetchone():
+            return None
+        conn.execute(
+            'INSERT INTO comments (post_id, user, text, time) VALUES (?, ?, ?, ?)',
+            (post_id, username, text, new_comment['time']))
+        conn.execute('UPDATE posts SET comment_count = comment_count + 1 WHERE id = ?', (post_id,))
+    sqlite_search.index_text(db, post_id, text)
+    feed_cache.post_changed(post_id)
+    return new_comment
+
+
+def get_comments_page(db, post_id, after=None, limit=20):
+    sql = 'SELECT * FROM comments WHERE post_id = ? '
+    params = [post_id]
+    if after is not None:
+        sql += 'AND (time > ? OR (time = ? AND id > ?)) '
+        params += [after[0], after[0], after[1]]
+    sql += 'ORDER BY time, id LIMIT ?'
+    params.append(limit + 1)
+
+    rows = db.query(sql, params)
+    comments = [Document({'user': row['user'], 'text': row['text'], 'time': row['time'],
+                          'post_id': row['post_id']}, row['id'])
+                for row in rows[:limit]]
+    next_cursor = (comments[-1]['time'], comments[-1].doc_id) if len(rows) > limit else None
+    return comments, next_cursor
+
+
+def move_embedded_comments(db):
+    # Comments have always had their own table here
+    return 0
+
+
+def backfill_post_counters(db):
+    with db.transaction() as conn:
+        return conn.execute(BACKFILL_POST_COUNTERS).rowcount
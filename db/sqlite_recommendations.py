@@ -0,0 +1,26 @@
+import json
+import time
+
+# SQLite twins of the functions in db/recommendations.py. Each user's
+# suggestions are one row, the list stored as JSON.
+
+
+def store_suggestions(db, suggestions, computed_at=None):
+    computed_at = computed_at or time.time()
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM recommendations')
+        conn.executemany(
+            'INSERT INTO recommendations (user, suggestions, computed_at) VALUES (?, ?, ?)',
+            [(username, json.dumps(pairs), computed_at) for username, pairs in suggestions.items()])
+        conn.execute('DELETE FROM recommendations_meta')
+        conn.execute('INSERT INTO recommendations_meta (computed_at) VALUES (?)', (computed_at,))
+
+
+def last_computed(db):
+    rows = db.query('SELECT computed_at FROM recommendations_meta')
+    return rows[0]['computed_at'] if rows else None
+
+
+def get_suggestions(db, username):
+    rows = db.query('SELECT suggestions FROM recommendations WHERE user = ?', (username,))
+    return [tuple(pair) for pair in json.loads(rows[0]['suggestions'])] if rows else None
@@ -0,0 +1,68 @@
+from db import sqlite_posts
+from db.search import idf, term_counts, tokenize
+from db.sqlite_store import placeholders
+
+# SQLite twins of the functions in db/search.py. The inverted index is the
+# post_terms table: one (term, post_id, count) row per posting.
+
+
+def _index_many(conn, items):
+    rows = []
+    for post_id, text in items:
+        rows += [(term, post_id, count) for term, count in term_counts(text).items()]
+    conn.executemany(
+        'INSERT INTO post_terms (term, post_id, count) VALUES (?, ?, ?) '
+        'ON CONFLICT (term, post_id) DO UPDATE SET count = count + excluded.count',
+        rows)
+
+
+def index_text(db, post_id, text):
+    with db.transaction() as conn:
+        _index_many(conn, [(post_id, text)])
+
+
+def search_posts(db, query, page=1, per_page=20):
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return [], 0
+
+    marks = placeholders(terms)
+    total_posts = max(db.query('SELECT COUNT(*) AS n FROM posts')[0]['n'], 1)
+    weights = {row['term']: idf(total_posts, row['df']) for row in db.query(
+        f'SELECT term, COUNT(*) AS df FROM post_terms WHERE term IN ({marks}) GROUP BY term',
+        terms)}
+    if not weights:
+        return [], 0
+
+    # Score in SQL so only one page of post ids comes back
+    cases = ' '.join('WHEN ? THEN ?' for _ in weights)
+    case_params = [value for item in weights.items() for value in item]
+    rows = db.query(
+        f'SELECT post_id, SUM(count * CASE term {cases} END) AS score FROM post_terms '
+        f'WHERE term IN ({marks}) GROUP BY post_id '
+        'ORDER BY score DESC, post_id DESC LIMIT ? OFFSET ?',
+        case_params + terms + [per_page, (page - 1) * per_page])
+    total = db.query(
+        f'SELECT COUNT(DISTINCT post_id) AS n FROM post_terms WHERE term IN ({marks})',
+        terms)[0]['n']
+
+    post_ids = [row['post_id'] for row in rows]
+    if not post_ids:
+        return [], total
+    by_id = {post.doc_id: post for post in sqlite_posts._post_docs(
+        db, db.query(f'SELECT * FROM posts WHERE id IN ({placeholders(post_ids)})', post_ids))}
+    return [by_id[post_id] for post_id in post_ids if post_id in by_id], total
+
+
+def rebuild_index(db):
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM post_terms')
+        posts = conn.execute("SELECT id, text FROM posts WHERE text != ''").fetchall()
+        comments = conn.execute('SELECT post_id, text FROM comments').fetchall()
+        _index_many(conn, [(row['id'], row['text']) for row in posts]
+                    + [(row['post_id'], row['text']) for row in comments])
+    return len(posts)
+
+
+def index_is_empty(db):
+    return not db.query('SELECT 1 FROM post_terms LIMIT 1')
@@ -0,0 +1,233 @@
+"""
+SQLite backend for the db.users / db.posts API.
+
+Select it with DB_STORAGE=sqlite (or YOUFACE_DB_STORAGE=sqlite); the
+functions in db/users.py and db/posts.py then hand off to their twins in
+db/sqlite_users.py and db/sqlite_posts.py, so handlers don't change.
+
+Import an existing db.json once with:
+
+    python -m db.sqlite_store db.json youface.db
+"""
+import argparse
+import contextlib
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id       INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    follower_count  INTEGER NOT NULL DEFAULT 0,
+    following_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS follows (
+    follower TEXT NOT NULL,
+    followee TEXT NOT NULL,
+    PRIMARY KEY (follower, followee)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS follows_by_followee ON follows (followee, follower);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id      INTEGER PRIMARY KEY,
+    user    TEXT NOT NULL,
+    user_id INTEGER,
+    text    TEXT NOT NULL,
+    time    REAL NOT NULL,
+    like_count    INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS posts_by_time ON posts (time);
+CREATE INDEX IF NOT EXISTS posts_by_user ON posts (user, time);
+
+CREATE TABLE IF NOT EXISTS likes (
+    id      INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    time    REAL NOT NULL,
+    UNIQUE (user_id, post_id)
+);
+CREATE INDEX IF NOT EXISTS likes_by_post ON likes (post_id);
+
+CREATE TABLE IF NOT EXISTS comments (
+    id      INTEGER PRIMARY KEY,
+    post_id INTEGER NOT NULL,
+    user    TEXT NOT NULL,
+    text    TEXT NOT NULL,
+    time    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_by_post ON comments (post_id, time);
+
+CREATE TABLE IF NOT EXISTS timelines (
+    user    TEXT NOT NULL,
+    time    REAL NOT NULL,
+    post_id INTEGER NOT NULL,
+    PRIMARY KEY (user, time, post_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timeline_owners (
+    user TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS post_terms (
+    term    TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    count   INTEGER NOT NULL,
+    PRIMARY KEY (term, post_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS recommendations (
+    user        TEXT PRIMARY KEY,
+    suggestions TEXT NOT NULL,
+    computed_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS recommendations_meta (
+    computed_at REAL NOT NULL
+);
+"""
+
+# Columns added after a table first shipped: (table, column, definition)
+ADDED_COLUMNS = [
+    ('posts', 'like_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('posts', 'comment_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'follower_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'following_count', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Only touches posts whose stored counters are wrong
+BACKFILL_POST_COUNTERS = """
+UPDATE posts SET
+    like_count = (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id),
+    comment_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)
+WHERE like_count != (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id)
+   OR comment_count != (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)
+"""
+
+BACKFILL_FOLLOW_COUNTS = """
+UPDATE users SET
+    follower_count = (SELECT COUNT(*) FROM follows WHERE followee = users.username),
+    following_count = (SELECT COUNT(*) FROM follows WHERE follower = users.username)
+"""
+
+
+class SqliteDB:
+    """One shared sqlite3 connection in WAL mode, guarded by a lock."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def query(self, sql, params=()):
+        """Runs a SELECT and returns all rows."""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Yields the connection; commits on success, rolls back on error."""
+        with self.lock, self.conn:
+            yield self.conn
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _migrate(self):
+        """Brings a database created by an older schema up to date."""
+        with self.transaction() as conn:
+            added = set()
+            for table, column, definition in ADDED_COLUMNS:
+                existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                    added.add(column)
+
+            if added & {'like_count', 'comment_count'}:
+                conn.execute(BACKFILL_POST_COUNTERS)
+            if added & {'follower_count', 'following_count'}:
+                conn.execute(BACKFILL_FOLLOW_COUNTS)
+
+
+def placeholders(values):
+    """'?, ?, ?' for an IN (...) clause over `values`."""
+    return ', '.join('?' * len(values))
+
+
+def import_json(db, json_path):
+    """
+    One-shot import of a TinyDB db.json into `db`. Document IDs are kept,
+    so likes keep pointing at the right users and posts.
+    """
+    with open(json_path, encoding='utf-8') as handle:
+        data = json.load(handle)
+
+    users = data.get('users', {})
+    posts = data.get('posts', {})
+    likes = data.get('likes', {})
+    comments = data.get('comments', {})
+    follows = data.get('follows', {})
+
+    with db.transaction() as conn:
+        for doc_id, user in users.items():
+            conn.execute(
+                'INSERT OR REPLACE INTO users (id, username, password) VALUES (?, ?, ?)',
+                (int(doc_id), user['username'], user.get('password', '')))
+
+            # Older db.json files store edges on both ends of each user; take the union
+            edges = [(user['username'], name) for name in user.get('following', [])]
+            edges += [(name, user['username']) for name in user.get('followers', [])]
+            conn.executemany(
+                'INSERT OR IGNORE INTO follows (follower, followee) VALUES (?, ?)', edges)
+
+        conn.executemany(
+            'INSERT OR IGNORE INTO follows (follower, followee) VALUES (?, ?)',
+            [(edge['follower'], edge['followee']) for edge in follows.values()])
+
+        # Comments table first, so its ids are kept
+        conn.executemany(
+            'INSERT OR IGNORE INTO comments (id, post_id, user, text, time) VALUES (?, ?, ?, ?, ?)',
+            [(int(doc_id), c['post_id'], c['user'], c['text'], c['time'])
+             for doc_id, c in comments.items()])
+
+        for doc_id, post in posts.items():
+            conn.execute(
+                'INSERT OR REPLACE INTO posts (id, user, user_id, text, time) VALUES (?, ?, ?, ?, ?)',
+                (int(doc_id), post['user'], post.get('user_id'), post.get('text', ''), post['time']))
+            # Older db.json files keep comments inside each post
+            conn.executemany(
+                'INSERT INTO comments (post_id, user, text, time) VALUES (?, ?, ?, ?)',
+                [(int(doc_id), c['user'], c['text'], c['time']) for c in post.get('comments', [])])
+
+        conn.executemany(
+            'INSERT OR IGNORE INTO likes (id, user_id, post_id, time) VALUES (?, ?, ?, ?)',
+            [(int(doc_id), like['user_id'], like['post_id'], like.get('time', 0))
+             for doc_id, like in likes.items()])
+
+        conn.execute(BACKFILL_POST_COUNTERS)
+        conn.execute(BACKFILL_FOLLOW_COUNTS)
+
+    return {'users': len(users), 'posts': len(posts), 'likes': len(likes), 'comments': len(comments)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a TinyDB db.json into SQLite.')
+    parser.add_argument('json_path', help='existing db.json')
+    parser.add_argument('sqlite_path', help='SQLite database to create or fill')
+    args = parser.parse_args()
+
+    db = SqliteDB(args.sqlite_path)
+    counts = import_json(db, args.json_path)
+    db.close()
+    print(f"Imported {counts['users']} users, {counts['posts']} posts, "
+          f"{counts['likes']} likes, {counts['comments']} comments into {args.sqlite_path}")
@@ -0,0 +1,101 @@
+from db import feed_cache, graph, metrics
+from db.sqlite_store import placeholders
+from db.timelines import TIMELINE_LENGTH, is_celebrity, lost_celebrity, merge_entries
+
+# SQLite twins of the functions in db/timelines.py. A user's timeline is
+# the set of (time, post_id) rows under their name; timeline_owners marks
+# which timelines have been built.
+
+
+def fan_out_post(db, author, post_id, post_time):
+    followers = author.get('follower_count', 0)
+    if is_celebrity(followers):
+        metrics.incr('timelines.fanout.skipped_posts')
+        metrics.incr('timelines.fanout.skipped_followers', followers)
+        return
+
+    with db.transaction() as conn:
+        written = conn.execute(
+            'INSERT OR IGNORE INTO timelines (user, time, post_id) '
+            'SELECT o.user, ?, ? FROM timeline_owners o '
+            'WHERE o.user = ? OR o.user IN (SELECT follower FROM follows WHERE followee = ?)',
+            (post_time, post_id, author['username'], author['username'])).rowcount
+    metrics.incr('timelines.fanout.writes', written)
+
+
+def invalidate(db, username):
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM timelines WHERE user = ?', (username,))
+        conn.execute('DELETE FROM timeline_owners WHERE user = ?', (username,))
+    feed_cache.feed_changed(username)
+
+
+def followers_lost(db, username, follower_count, lost=1):
+    if not lost_celebrity(follower_count, lost):
+        return
+    with db.transaction() as conn:
+        names = [row['follower'] for row in conn.execute(
+            'SELECT follower FROM follows WHERE followee = ?', (username,))] + [username]
+        for table in ('timelines', 'timeline_owners'):
+            conn.execute(
+                f'DELETE FROM {table} '
+                'WHERE user = ? OR user IN (SELECT follower FROM follows WHERE followee = ?)',
+                (username, username))
+    for name in names:
+        feed_cache.feed_changed(name)
+
+
+def _build_timeline(conn, username, skip):
+    conn.execute(
+        'INSERT OR IGNORE INTO timelines (user, time, post_id) '
+        'SELECT ?, time, id FROM posts '
+        "WHERE text != '' AND (user = ? OR user IN (SELECT followee FROM follows WHERE follower = ?)) "
+        f'AND user NOT IN ({placeholders(skip)}) '
+        'ORDER BY time DESC LIMIT ?',
+        [username, username, username] + skip + [TIMELINE_LENGTH])
+    conn.execute('INSERT INTO timeline_owners (user) VALUES (?)', (username,))
+
+
+def _trim_timeline(conn, username):
+    conn.execute(
+        'DELETE FROM timelines WHERE user = ? AND (time, post_id) IN '
+        '(SELECT time, post_id FROM timelines WHERE user = ? '
+        'ORDER BY time DESC, post_id DESC LIMIT -1 OFFSET ?)',
+        (username, username, TIMELINE_LENGTH))
+
+
+def _before_clause(before, time_column, id_column):
+    if before is None:
+        return '', []
+    return (f'AND ({time_column} < ? OR ({time_column} = ? AND {id_column} < ?)) ',
+            [before[0], before[0], before[1]])
+
+
+def read_timeline(db, user, before=None, limit=20):
+    username = user['username']
+    # Before the transaction: the graph is built under DB_LOCK
+    celebrities = graph.celebrities_followed(db, user.doc_id)
+    with db.transaction() as conn:
+        if not conn.execute('SELECT 1 FROM timeline_owners WHERE user = ?', (username,)).fetchone():
+            _build_timeline(conn, username, celebrities)
+        elif before is None:
+            # Fan-out only appends; the cap is enforced when a feed is opened
+            _trim_timeline(conn, username)
+
+    # One more than a page from each source tells us if there's a next page
+    clause, params = _before_clause(before, 'time', 'post_id')
+    rows = db.query(
+        f'SELECT time, post_id FROM timelines WHERE user = ? {clause}'
+        'ORDER BY time DESC, post_id DESC LIMIT ?',
+        [username] + params + [limit + 1])
+    sources = [[(row['time'], row['post_id']) for row in rows]]
+
+    clause, params = _before_clause(before, 'time', 'id')
+    for name in celebrities:
+        rows = db.query(
+            f"SELECT time, id FROM posts WHERE user = ? AND text != '' {clause}"
+            'ORDER BY time DESC, id DESC LIMIT ?',
+            [name] + params + [limit + 1])
+        sources.append([(row['time'], row['id']) for row in rows])
+
+    return merge_entries(sources, limit)
@@ -0,0 +1,202 @@
+from tinydb.table import Document
+
+from db import graph, sqlite_timelines, user_index
+from db.sqlite_store import placeholders
+from db.users import USER_FIELDS, _names_sorted, _page
+
+# SQLite twins of the functions in db/users.py. User documents are built
+# in the same shape TinyDB returns; edges stay in the follows table.
+
+
+def _user_docs(db, rows):
+    """Turns user rows into Documents."""
+    return [Document({
+        'username': row['username'],
+        'password': row['password'],
+        'follower_count': row['follower_count'],
+        'following_count': row['following_count'],
+    }, row['id']) for row in rows]
+
+
+def new_user(db, username, password):
+    with db.transaction() as conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+            (username, password))
+        if not cursor.rowcount:
+            return None
+    user_index.user_added(db, username)
+    graph.user_added(db, cursor.lastrowid, username)
+    return cursor.lastrowid
+
+
+def get_user(db, username, password):
+    rows = db.query(
+        'SELECT * FROM users WHERE username = ? AND password = ?',
+        (username, password))
+    return _user_docs(db, rows)[0] if rows else None
+
+
+def get_user_by_name(db, username):
+    rows = db.query('SELECT * FROM users WHERE username = ?', (username,))
+    return _user_docs(db, rows)[0] if rows else None
+
+
+def get_all_users(db):
+    return _user_docs(db, db.query('SELECT * FROM users ORDER BY id'))
+
+
+def delete_user(db, username, password):
+    with db.transaction() as conn:
+        rows = conn.execute(
+            'SELECT id FROM users WHERE username = ? AND password = ?',
+            (username, password)).fetchall()
+        followees, followers = [], []
+        if rows:
+            followees = [row['followee'] for row in conn.execute(
+                'SELECT followee FROM follows WHERE follower = ?', (username,))]
+            followers = [row['follower'] for row in conn.execute(
+                'SELECT follower FROM follows WHERE followee = ?', (username,))]
+            conn.execute('DELETE FROM users WHERE id = ?', (rows[0]['id'],))
+            conn.execute(
+                'UPDATE users SET follower_count = MAX(follower_count - 1, 0) '
+                'WHERE username IN (SELECT followee FROM follows WHERE follower = ?)',
+                (username,))
+            conn.execute(
+                'UPDATE users SET following_count = MAX(following_count - 1, 0) '
+                'WHERE username IN (SELECT follower FROM follows WHERE followee = ?)',
+                (username,))
+            conn.execute(
+                'DELETE FROM follows WHERE follower = ? OR followee = ?',
+                (username, username))
+    if rows:
+        for followee in get_users_by_names(db, followees, fields=('username', 'follower_count')):
+            user_index.followers_changed(db, followee['username'], -1)
+            sqlite_timelines.followers_lost(db, followee['username'], followee['follower_count'])
+        user_index.user_removed(db, username)
+        graph.user_removed(db, rows[0]['id'])
+        for name in followers + [username]:
+            sqlite_timelines.invalidate(db, name)
+    return [row['id'] for row in rows]
+
+
+def follow_user(db, follower_user, user_to_follow_name):
+    user_to_follow = get_user_by_name(db, user_to_follow_name)
+    if not user_to_follow:
+        return f"User '{user_to_follow_name}' not found.", 'danger'
+    if user_to_follow_name == follower_user['username']:
+        return "You cannot follow yourself.", 'warning'
+
+    with db.transaction() as conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO follows (follower, followee) VALUES (?, ?)',
+            (follower_user['username'], user_to_follow_name))
+        if cursor.rowcount:
+            conn.execute('UPDATE users SET following_count = following_count + 1 WHERE id = ?',
+                         (follower_user.doc_id,))
+            conn.execute('UPDATE users SET follower_count = follower_count + 1 WHERE id = ?',
+                         (user_to_follow.doc_id,))
+    if not cursor.rowcount:
+        return f"You are already following {user_to_follow_name}.", 'info'
+
+    follower_user['following_count'] = follower_user.get('following_count', 0) + 1
+    user_index.followers_changed(db, user_to_follow_name, 1)
+    graph.followed(db, follower_user.doc_id, user_to_follow.doc_id)
+    sqlite_timelines.invalidate(db, follower_user['username'])
+    return f"You are now following {user_to_follow_name}.", 'success'
+
+
+def unfollow_user(db, follower_user, user_to_unfollow_name):
+    with db.transaction() as conn:
+        cursor = conn.execute(
+            'DELETE FROM follows WHERE follower = ? AND followee = ?',
+            (follower_user['username'], user_to_unfollow_name))
+        if cursor.rowcount:
+            conn.execute('UPDATE users SET following_count = MAX(following_count - 1, 0) WHERE id = ?',
+                         (follower_user.doc_id,))
+            conn.execute('UPDATE users SET follower_count = MAX(follower_count - 1, 0) WHERE username = ?',
+                         (user_to_unfollow_name,))
+    if not cursor.rowcount:
+        return "You are not following this user.", 'warning'
+
+    follower_user['following_count'] = max(follower_user.get('following_count', 0) - 1, 0)
+    user_index.followers_changed(db, user_to_unfollow_name, -1)
+    unfollowed = db.query('SELECT id, follower_count FROM users WHERE username = ?', (user_to_unfollow_name,))
+    if unfollowed:
+        graph.unfollowed(db, follower_user.doc_id, unfollowed[0]['id'])
+        sqlite_timelines.followers_lost(db, user_to_unfollow_name, unfollowed[0]['follower_count'])
+    sqlite_timelines.invalidate(db, follower_user['username'])
+    return f"You are no longer following {user_to_unfollow_name}.", 'success'
+
+
+def get_following_names(db, username):
+    rows = db.query('SELECT followee FROM follows WHERE follower = ?', (username,))
+    return [row['followee'] for row in rows]
+
+
+def get_follower_names(db, username):
+    rows = db.query('SELECT follower FROM follows WHERE followee = ?', (username,))
+    return [row['follower'] for row in rows]
+
+
+def get_follow_edges(db):
+    return [(row['follower'], row['followee'])
+            for row in db.query('SELECT follower, followee FROM follows')]
+
+
+def move_follow_lists(db):
+    # Edges have always had their own table here
+    return 0
+
+
+def get_users_by_names(db, names, fields=USER_FIELDS):
+    names = list(names)
+    if not names:
+        return []
+    rows = db.query(f'SELECT * FROM users WHERE username IN ({placeholders(names)})', names)
+    by_name = {row['username']: row for row in rows}
+    return [Document({field: by_name[name][field] for field in fields}, by_name[name]['id'])
+            for name in names if name in by_name]
+
+
+def get_user_friends(db, user, limit=None):
+    return get_users_by_names(db, _names_sorted(db, graph.mutuals(db, user.doc_id), limit))
+
+
+def get_user_following(db, user, limit=None):
+    return get_users_by_names(db, _names_sorted(db, graph.following_only(db, user.doc_id), limit))
+
+
+def get_user_followers(db, user, limit=None):
+    return get_users_by_names(db, _names_sorted(db, graph.followers_only(db, user.doc_id), limit))
+
+
+def get_followers_page(db, username, after=None, limit=50):
+    rows = db.query(
+        'SELECT follower FROM follows WHERE followee = ? AND follower > ? '
+        'ORDER BY follower LIMIT ?',
+        (username, after or '', limit + 1))
+    return _page([row['follower'] for row in rows], limit)
+
+
+def get_following_page(db, username, after=None, limit=50):
+    rows = db.query(
+        'SELECT followee FROM follows WHERE follower = ? AND followee > ? '
+        'ORDER BY followee LIMIT ?',
+        (username, after or '', limit + 1))
+    return _page([row['followee'] for row in rows], limit)
+
+
+def find_users(db, query, exclude=(), limit=None):
+    if not query:
+        return []
+    return get_users_by_names(db, user_index.containing(db, query, skip=set(exclude), limit=limit))
+
+
+def get_potential_friends(db, user, query=None, limit=None):
+    exclude = set(get_following_names(db, user['username'])) | {user['username']}
+    if query:
+        names = user_index.containing(db, query, skip=exclude, limit=limit)
+    else:
+        names = user_index.prefixed(db, '', skip=exclude, limit=limit)
+    return get_users_by_names(db, names)
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+
+from tinydb.storages import Storage, touch
+
+# Same on-disk layout db.json has always used
+JSON_FORMAT = {'sort_keys': True, 'indent': 4, 'separators': (',', ': ')}
+
+
+def atomic_write(path, text, encoding='utf-8'):
+    """
+    Writes `text` to a temp file next to `path`, fsyncs it and renames it
+    over `path`, so a crash leaves either the old file or the new one.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding=encoding) as handle:
+        handle.write(text)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+    # Make the rename itself durable (not supported on Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class CachedJSONStorage(Storage):
+    """
+    JSON file storage that parses db.json once and then serves every read
+    from memory. Writes are still written straight through to the file.
+    """
+
+    def __init__(self, path, create_dirs=False, encoding='utf-8'):
+        super().__init__()
+        self.path = path
+        self.encoding = encoding
+
+        touch(path, create_dirs=create_dirs)
+        with open(path, encoding=encoding) as handle:
+            contents = handle.read()
+        self._data = json.loads(contents) if contents.strip() else None
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        self._data = data
+        atomic_write(self.path, json.dumps(data, **JSON_FORMAT), self.encoding)
+
+
+class WriteBehindJSONStorage(CachedJSONStorage):
+    """
+    Cached JSON storage that buffers writes in memory and group-commits
+    them: db.json is rewritten once every `flush_interval` seconds, or
+    as soon as `flush_every` writes are waiting, whichever comes first.
+
+    A background thread does the disk work, so a burst of writes costs
+    one file rewrite instead of one per write. Call close() (or flush())
+    before exiting to persist anything still buffered.
+    """
+
+    def __init__(self, path, flush_interval=1.0, flush_every=100,
+                 lock=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+
+        # `lock` guards self._data; pass the lock the tables write under so
+        # a flush never serializes a half-applied update
+        self._lock = lock or threading.RLock()
+        # Keeps file writes in order when two flushes overlap
+        self._file_lock = threading.Lock()
+
+        self._pending = 0
+        self._generation = 0
+        self._written_generation = 0
+
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = None
+
+    def write(self, data):
+        with self._lock:
+            self._data = data
+            self._pending += 1
+            pending = self._pending
+
+        self._start_flusher()
+        if pending >= self.flush_every:
+            self._wakeup.set()
+
+    def flush(self):
+        """Writes buffered changes to disk now. Returns True if it wrote."""
+        with self._lock:
+            if not self._pending:
+                return False
+            serialized = json.dumps(self._data, **JSON_FORMAT)
+            self._pending = 0
+            self._generation += 1
+            generation = self._generation
+
+        with self._file_lock:
+            # A newer snapshot may already be on disk
+            if generation > self._written_generation:
+                atomic_write(self.path, serialized, self.encoding)
+                self._written_generation = generation
+        return True
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self.flush()
+
+    def _start_flusher(self):
+        if self._flusher is not None or self._closed:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name='db-flusher', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class WALStorage(CachedJSONStorage):
+    """
+    Append-only storage. db.json is a snapshot; every mutation after it is
+    appended as one JSON line to `<path>.wal`, so a write costs the size
+    of the changed document rather than the size of the database.
+
+    On open the snapshot is loaded and the log replayed on top of it.
+    Once `compact_every` records have piled up, a background thread folds
+    them into a new snapshot and starts a fresh log.
+
+    Mutations reach the log through log_set()/log_delete(), which are
+    called by the table layer (see tables.WALTable) once per table write,
+    so a write touching many documents costs one append and one fsync.
+    """
+
+    def __init__(self, path, compact_every=1000, lock=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.log_path = path + '.wal'
+        self.compact_every = compact_every
+
+        self._lock = lock or threading.RLock()
+        self._compactor = None
+
+        # Recover: a log left behind by an interrupted compaction is older
+        # than the live log, so it is replayed first. Every record is an
+        # absolute "document is now X", so replaying twice is harmless.
+        if self._data is None:
+            self._data = {}
+        interrupted, _ = self._replay(self.log_path + '.compacting')
+        self._records, good_bytes = self._replay(self.log_path)
+        self._tables = set(self._data)
+
+        if interrupted:
+            # Finish the interrupted compaction before a new one can
+            # overwrite its log
+            atomic_write(self.path, json.dumps(self._data, **JSON_FORMAT), self.encoding)
+            os.remove(self.log_path + '.compacting')
+
+        # Cut off a torn final record, or the next append would land on
+        # the same line and be lost with it on the following replay
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > good_bytes:
+            with open(self.log_path, 'r+b') as handle:
+                handle.truncate(good_bytes)
+                os.fsync(handle.fileno())
+
+        self._log = open(self.log_path, 'a', encoding=self.encoding)
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        # The table layer has already logged document changes; only whole
+        # tables dropped through TinyDB.drop_table(s) are noticed here.
+        with self._lock:
+            self._data = data
+            for table in self._tables - set(data):
+                self._append([{'op': 'drop', 'table': table}])
+            self._tables = set(data)
+
+    def log_set(self, table, docs):
+        """Logs the new contents of `docs`, (doc_id, doc) pairs, in one append."""
+        with self._lock:
+            self._tables.add(table)
+            self._append([{'op': 'set', 'table': table, 'id': str(doc_id), 'doc': doc}
+                          for doc_id, doc in docs])
+
+    def log_delete(self, table, doc_ids):
+        """Logs the removal of `doc_ids` in one append."""
+        with self._lock:
+            self._append([{'op': 'del', 'table': table, 'id': str(doc_id)} for doc_id in doc_ids])
+
+    def compact(self):
+        """Folds the log into a fresh db.json snapshot."""
+        with self._lock:
+            serialized = json.dumps(self._data, **JSON_FORMAT)
+            # New writes go to a fresh log from here on
+            self._log.close()
+            os.replace(self.log_path, self.log_path + '.compacting')
+            self._log = open(self.log_path, 'a', encoding=self.encoding)
+            self._records = 0
+
+        atomic_write(self.path, serialized, self.encoding)
+        os.remove(self.log_path + '.compacting')
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        self._log.close()
+
+    def _append(self, records):
+        if not records:
+            return
+        self._log.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+        self._records += len(records)
+        if self._records >= self.compact_every:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(
+            target=self.compact, name='db-compactor', daemon=True)
+        self._compactor.start()
+
+    def _replay(self, log_path):
+        """
+        Applies the records in `log_path` to self._data. Returns (records
+        applied, byte offset just past the last complete record).
+        """
+        if not os.path.exists(log_path):
+            return 0, 0
+
+        count = good_bytes = 0
+        with open(log_path, 'rb') as handle:
+            for line in handle:
+                # A record only counts once its newline is on disk; anything
+                # after the last one is a torn append from a crash
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line.decode(self.encoding))
+                except ValueError:
+                    break
+
+                if record['op'] == 'set':
+                    self._data.setdefault(record['table'], {})[record['id']] = record['doc']
+                elif record['op'] == 'del':
+                    self._data.get(record['table'], {}).pop(record['id'], None)
+                elif record['op'] == 'drop':
+                    self._data.pop(record['table'], None)
+                count += 1
+                good_bytes += len(line)
+        return count, good_bytes
@@ -0,0 +1,303 @@
+import collections.abc
+import functools
+import itertools
+import threading
+
+import tinydb
+from tinydb.table import Table
+
+from db.indexes import INDEXED_FIELDS, SORTED_FIELDS, HashIndex, SortedIndex, equality_terms
+
+# One lock for the whole process. It is re-entrant so db/ functions that
+# read-modify-write several documents can hold it around their table calls.
+DB_LOCK = threading.RLock()
+
+
+def _locked(method):
+    """Runs a table method while holding DB_LOCK."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with DB_LOCK:
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class LockedTable(Table):
+    """A TinyDB table that is safe to share between request threads."""
+    insert = _locked(Table.insert)
+    insert_multiple = _locked(Table.insert_multiple)
+    all = _locked(Table.all)
+    search = _locked(Table.search)
+    get = _locked(Table.get)
+    contains = _locked(Table.contains)
+    update = _locked(Table.update)
+    update_multiple = _locked(Table.update_multiple)
+    upsert = _locked(Table.upsert)
+    remove = _locked(Table.remove)
+    truncate = _locked(Table.truncate)
+    count = _locked(Table.count)
+    __len__ = _locked(Table.__len__)
+
+
+class _IntKeyView(collections.abc.MutableMapping):
+    """A raw table dict (str doc_id keys) seen through int doc_ids, as Table's updaters expect."""
+
+    def __init__(self, raw, id_class):
+        self.raw = raw
+        self.id_class = id_class
+
+    def __getitem__(self, doc_id):
+        return self.raw[str(doc_id)]
+
+    def __setitem__(self, doc_id, doc):
+        self.raw[str(doc_id)] = doc
+
+    def __delitem__(self, doc_id):
+        del self.raw[str(doc_id)]
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self.raw
+
+    def __iter__(self):
+        return (self.id_class(doc_id) for doc_id in self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+
+class IndexedTable(LockedTable):
+    """
+    A LockedTable with the secondary hash indexes listed in
+    indexes.INDEXED_FIELDS. search/get/update/remove look at the query and,
+    when it pins an indexed field to a value, only test the matching
+    documents instead of scanning the table.
+
+    Every mutator reports the doc_ids it touched to _documents_changed /
+    _documents_removed, which keep the indexes current.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indexes = None
+        self._sorted_indexes = None
+
+    # --- Reads ---
+
+    def search(self, cond):
+        with DB_LOCK:
+            matches = self._indexed_matches(cond)
+            if matches is None:
+                return super().search(cond)
+            return [self.document_class(doc, self.document_id_class(doc_id))
+                    for doc_id, doc in matches]
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        with DB_LOCK:
+            if cond is not None and doc_id is None and doc_ids is None:
+                matches = self._indexed_matches(cond)
+                if matches is not None:
+                    for doc_id_, doc in matches:
+                        return self.document_class(doc, self.document_id_class(doc_id_))
+                    return None
+            return super().get(cond, doc_id, doc_ids)
+
+    def count(self, cond):
+        return len(self.search(cond))
+
+    def lookup(self, field, values):
+        """
+        Documents whose `field` equals any of `values`, in the order of
+        `values`, from one table read. Goes through the hash index on
+        (field,) when INDEXED_FIELDS has one and scans otherwise.
+        """
+        with DB_LOCK:
+            index = next((index for index in self._build_indexes()[0] if index.fields == (field,)), None)
+            table = self._read_table()
+            if index is None:
+                by_value = {}
+                for doc_id, doc in table.items():
+                    by_value.setdefault(doc.get(field), []).append(doc_id)
+                doc_ids_for = lambda value: by_value.get(value, ())
+            else:
+                doc_ids_for = lambda value: sorted(index.lookup((value,)), key=int)
+
+            return [self.document_class(table[doc_id], self.document_id_class(doc_id))
+                    for value in values
+                    for doc_id in doc_ids_for(value)]
+
+    def ascending(self, field, limit=None, after=None, partition=None):
+        """
+        Up to `limit` documents (all if None) in ascending (field, doc_id)
+        order, starting strictly above `after`: a value, or a (value,
+        doc_id) tuple cursor. `partition` is as for newest(), and
+        (field, partition field) must be in SORTED_FIELDS.
+        """
+        partition_field, group = partition if partition is not None else (None, None)
+        with DB_LOCK:
+            index = self._build_indexes()[1][(field, partition_field)]
+            table = self._read_table()
+            doc_ids = itertools.islice(index.ascending(after, group), limit)
+            return [self.document_class(table[str(doc_id)], doc_id) for doc_id in doc_ids]
+
+    def newest(self, field, limit=None, before=None, cond=None, partition=None):
+        """
+        Up to `limit` documents (all if None) in descending (field, doc_id)
+        order, starting strictly below the `before` cursor and skipping any
+        that fail `cond`. `partition` is a (field, value) pair, such as
+        ('user', 'alice'), to only walk that value's documents.
+        (field, partition field) must be listed in indexes.SORTED_FIELDS.
+        """
+        partition_field, group = partition if partition is not None else (None, None)
+        with DB_LOCK:
+            index = self._build_indexes()[1][(field, partition_field)]
+            table = self._read_table()
+            docs = []
+            for doc_id in index.descending(before, group):
+                doc = table[str(doc_id)]
+                if cond is not None and not cond(doc):
+                    continue
+                docs.append(self.document_class(doc, doc_id))
+                if limit is not None and len(docs) >= limit:
+                    break
+            return docs
+
+    # --- Writes ---
+
+    def insert(self, document):
+        with DB_LOCK:
+            doc_id = super().insert(document)
+            self._documents_changed([doc_id])
+            return doc_id
+
+    def insert_multiple(self, documents):
+        with DB_LOCK:
+            doc_ids = super().insert_multiple(documents)
+            self._documents_changed(doc_ids)
+            return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with DB_LOCK:
+            if cond is not None and doc_ids is None:
+                matches = self._indexed_matches(cond)
+                if matches is not None:
+                    cond, doc_ids = None, [int(doc_id) for doc_id, _ in matches]
+            updated = super().update(fields, cond, doc_ids)
+            self._documents_changed(updated)
+            return updated
+
+    def update_multiple(self, updates):
+        with DB_LOCK:
+            updated = super().update_multiple(updates)
+            self._documents_changed(updated)
+            return updated
+
+    def remove(self, cond=None, doc_ids=None):
+        with DB_LOCK:
+            if cond is not None and doc_ids is None:
+                matches = self._indexed_matches(cond)
+                if matches is not None:
+                    cond, doc_ids = None, [int(doc_id) for doc_id, _ in matches]
+            removed = super().remove(cond, doc_ids)
+            self._documents_removed(removed)
+            return removed
+
+    def truncate(self):
+        with DB_LOCK:
+            doc_ids = [int(doc_id) for doc_id in self._read_table()]
+            super().truncate()
+            self._documents_removed(doc_ids)
+
+    def _update_table(self, updater):
+        """
+        Table._update_table copies the whole table into an int-keyed dict
+        and back for every insert/update/remove, so each write is
+        O(table). Apply `updater` to the storage's data in place instead,
+        touching only the documents it changes, and hand the same data
+        back to the storage.
+        """
+        tables = self._storage.read()
+        if tables is None:
+            tables = {}
+        updater(_IntKeyView(tables.setdefault(self.name, {}), self.document_id_class))
+        self._storage.write(tables)
+        self.clear_cache()
+
+    # --- Index maintenance ---
+
+    def _all_indexes(self):
+        return self._indexes + list(self._sorted_indexes.values())
+
+    def _documents_changed(self, doc_ids):
+        if self._indexes is None:
+            return
+        table = self._read_table()
+        for doc_id in doc_ids:
+            for index in self._all_indexes():
+                index.add(str(doc_id), table[str(doc_id)])
+
+    def _documents_removed(self, doc_ids):
+        if self._indexes is None:
+            return
+        for doc_id in doc_ids:
+            for index in self._all_indexes():
+                index.discard(str(doc_id))
+
+    def _build_indexes(self):
+        """
+        Returns (hash indexes, {(field, partition): sorted index}). They
+        are built on first use, in one pass over the table.
+        """
+        if self._indexes is None:
+            self._indexes = [HashIndex(fields) for fields in INDEXED_FIELDS.get(self.name, [])]
+            self._sorted_indexes = {(field, partition): SortedIndex(field, partition)
+                                    for field, partition in SORTED_FIELDS.get(self.name, [])}
+            for doc_id, doc in self._read_table().items():
+                for index in self._all_indexes():
+                    index.add(doc_id, doc)
+        return self._indexes, self._sorted_indexes
+
+    def _indexed_matches(self, cond):
+        """
+        (doc_id, raw doc) pairs matching `cond` in doc_id order, or None
+        when no index covers the query and the caller should scan.
+        """
+        terms = equality_terms(getattr(cond, '_hash', None))
+        if not terms:
+            return None
+
+        # Indexes are listed most specific first
+        for index in self._build_indexes()[0]:
+            if all(field in terms for field in index.fields):
+                candidates = index.lookup(tuple(terms[field] for field in index.fields))
+                break
+        else:
+            return None
+
+        table = self._read_table()
+        return [(doc_id, table[doc_id])
+                for doc_id in sorted(candidates, key=int)
+                if cond(table[doc_id])]
+
+
+class WALTable(IndexedTable):
+    """An IndexedTable that appends every changed document to the storage's log."""
+
+    def _documents_changed(self, doc_ids):
+        super()._documents_changed(doc_ids)
+        table = self._read_table()
+        self._storage.log_set(self.name, [(doc_id, table[str(doc_id)]) for doc_id in doc_ids])
+
+    def _documents_removed(self, doc_ids):
+        super()._documents_removed(doc_ids)
+        self._storage.log_delete(self.name, doc_ids)
+
+
+class SharedTinyDB(tinydb.TinyDB):
+    """TinyDB handle that lives for the whole process."""
+    table_class = IndexedTable
+    table = _locked(tinydb.TinyDB.table)
+
+
+class WALTinyDB(SharedTinyDB):
+    """Shared handle over a WALStorage."""
+    table_class = WALTable
@@ -0,0 +1,204 @@
+import heapq
+import itertools
+import math
+import time
+
+import tinydb
+
+from db import feed_cache, graph, helpers, metrics, users
+
+# Per-user home timelines, filled by fan-out on write: when someone posts,
+# the post is pushed onto the timeline of every follower (and the author),
+# so reading a feed is one timeline lookup instead of a global scan.
+#
+# A timeline is one {'user': username, 'time': time, 'post_id': post_id}
+# document per entry in the 'timelines' table, kept in time order per user
+# by a sorted index, so fan-out writes one small document per follower.
+# A {'user': username} document in 'timeline_owners' marks the timelines
+# that have been built. Timelines are built lazily on first read (dropping
+# any rows left over from an older layout), capped at TIMELINE_LENGTH when
+# a feed is opened, and dropped whenever the owner follows or unfollows
+# someone (or someone they follow is deleted), so they never need a
+# separate migration.
+#
+# Celebrities (authors with helpers.CELEBRITY_FOLLOWERS followers or more)
+# are the exception: pushing each of their posts to every follower would
+# cost millions of writes, so they are never stored in timelines. Instead,
+# read_timeline k-way merges their recent posts into the stored entries.
+
+TIMELINE_LENGTH = 800
+
+Timeline = tinydb.Query()
+Post = tinydb.Query()
+
+metrics.register_gauge('timelines.celebrity_followers', lambda: helpers.CELEBRITY_FOLLOWERS)
+
+
+def is_celebrity(follower_count):
+    return follower_count >= helpers.CELEBRITY_FOLLOWERS
+
+
+def merge_entries(sources, limit):
+    """
+    k-way merges newest-first iterators of (time, post_id) tuples into one
+    page of at most `limit` entries, dropping duplicates. Returns
+    (page, next_cursor) and records the merge cost in metrics.
+    """
+    started = time.perf_counter()
+    page = []
+    seen = set()
+    popped = 0
+    has_more = False
+    for entry in heapq.merge(*sources, reverse=True):
+        popped += 1
+        if entry[1] in seen:
+            continue
+        if len(page) == limit:
+            has_more = True
+            break
+        seen.add(entry[1])
+        page.append(entry)
+
+    metrics.incr('timelines.merge.reads')
+    metrics.observe('timelines.merge.sources', len(sources))
+    metrics.observe('timelines.merge.entries', popped)
+    metrics.observe('timelines.merge.seconds', time.perf_counter() - started)
+    return page, (page[-1] if has_more else None)
+
+
+@helpers.dispatch
+def fan_out_post(db, author, post_id, post_time):
+    """
+    Pushes a new post onto the timelines of the author and their followers.
+    Only timelines that already exist are touched; the rest will pick the
+    post up when they are first built. Celebrity posts are not pushed at
+    all; readers merge them in.
+    """
+    follower_count = author.get('follower_count', 0)
+    if is_celebrity(follower_count):
+        metrics.incr('timelines.fanout.skipped_posts')
+        metrics.incr('timelines.fanout.skipped_followers', follower_count)
+        return
+
+    # Followers are read under the same lock as the insert, so a follow in
+    # between (which rebuilds that follower's timeline) can't add it twice
+    with helpers.DB_LOCK:
+        recipients = set(users.get_follower_names(db, author['username'])) | {author['username']}
+        owners = db.table('timeline_owners').lookup('user', sorted(recipients))
+        # One table write (and one WAL append) for every follower at once
+        db.table('timelines').insert_multiple(
+            {'user': owner['user'], 'time': post_time, 'post_id': post_id} for owner in owners)
+    metrics.incr('timelines.fanout.writes', len(owners))
+
+
+@helpers.dispatch
+def invalidate(db, username):
+    """Drops a user's timeline so it is rebuilt from scratch on next read."""
+    with helpers.DB_LOCK:
+        db.table('timeline_owners').remove(Timeline.user == username)
+        db.table('timelines').remove(Timeline.user == username)
+    feed_cache.feed_changed(username)
+
+
+def lost_celebrity(follower_count, lost):
+    """Whether losing `lost` followers, leaving `follower_count`, took an author below the threshold."""
+    return is_celebrity(follower_count + lost) and not is_celebrity(follower_count)
+
+
+@helpers.dispatch
+def followers_lost(db, username, follower_count, lost=1):
+    """
+    Called after `username` lost `lost` followers and was left with
+    `follower_count`. Fan-out skipped their posts while they were a
+    celebrity; if they no longer are, readers stop merging those posts in,
+    so the author's and every remaining follower's timeline is dropped
+    and rebuilt with them on next read.
+    """
+    if not lost_celebrity(follower_count, lost):
+        return
+    owners = db.table('timeline_owners')
+    timelines = db.table('timelines')
+    with helpers.DB_LOCK:
+        names = users.get_follower_names(db, username) + [username]
+        owners.remove(doc_ids=[owner.doc_id for owner in owners.lookup('user', names)])
+        timelines.remove(doc_ids=[row.doc_id for row in timelines.lookup('user', names)])
+    for name in names:
+        feed_cache.feed_changed(name)
+
+
+def _authors(db, user):
+    """The user and everyone they follow."""
+    return set(users.get_following_names(db, user['username'])) | {user['username']}
+
+
+def _celebrities(db, user):
+    """The user and the people they follow who are read-time merged."""
+    return graph.celebrities_followed(db, user.doc_id)
+
+
+def _recent_posts(db, author, before, count):
+    """The author's newest `count` (time, post_id) entries before the cursor."""
+    posts = db.table('posts').newest(
+        'time', count, before=before, cond=Post.text != '', partition=('user', author))
+    return [(post['time'], post.doc_id) for post in posts]
+
+
+def _build_timeline(db, user, skip):
+    """Stores the newest posts by the user and everyone they follow. Caller holds DB_LOCK."""
+    username = user['username']
+    authors = _authors(db, user) - set(skip)
+    newest = heapq.merge(*(_recent_posts(db, author, None, TIMELINE_LENGTH) for author in authors),
+                         reverse=True)
+
+    timelines = db.table('timelines')
+    timelines.remove(Timeline.user == username)
+    timelines.insert_multiple(
+        {'user': username, 'time': post_time, 'post_id': post_id}
+        for post_time, post_id in itertools.islice(newest, TIMELINE_LENGTH))
+    db.table('timeline_owners').insert({'user': username})
+
+
+def _trim_timeline(db, username):
+    """Drops the user's oldest entries beyond TIMELINE_LENGTH. Caller holds DB_LOCK."""
+    timelines = db.table('timelines')
+    excess = timelines.count(Timeline.user == username) - TIMELINE_LENGTH
+    if excess > 0:
+        oldest = timelines.ascending('time', excess, partition=('user', username))
+        timelines.remove(doc_ids=[entry.doc_id for entry in oldest])
+
+
+def _stored_entries(db, username, before, count):
+    """The newest `count` (time, post_id) entries of a stored timeline before the cursor."""
+    if before is None:
+        rows = db.table('timelines').newest('time', count, partition=('user', username))
+    else:
+        # The index orders equal times by doc_id, the cursor by post_id
+        before = tuple(before)
+        rows = db.table('timelines').newest(
+            'time', count, before=(before[0], math.inf), partition=('user', username),
+            cond=lambda row: (row['time'], row['post_id']) < before)
+    return sorted(((row['time'], row['post_id']) for row in rows), reverse=True)
+
+
+@helpers.dispatch
+def read_timeline(db, user, before=None, limit=20):
+    """
+    Returns one page of (time, post_id) pairs from the user's timeline,
+    newest first and strictly before the `before` cursor, plus the cursor
+    for the next page (None on the last page).
+    """
+    username = user['username']
+
+    with helpers.DB_LOCK:
+        celebrities = _celebrities(db, user)
+        if not db.table('timeline_owners').contains(Timeline.user == username):
+            _build_timeline(db, user, skip=set(celebrities))
+        elif before is None:
+            # Fan-out only appends; the cap is enforced when a feed is opened
+            _trim_timeline(db, username)
+
+        # One more than a page from each source tells us if there's a next page
+        sources = [_stored_entries(db, username, before, limit + 1)]
+        sources += [_recent_posts(db, name, before, limit + 1) for name in celebrities]
+
+    return merge_entries(sources, limit)
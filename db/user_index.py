@@ -0,0 +1,220 @@
+import weakref
+
+from db import users
+from db.tables import DB_LOCK
+
+# In-memory username index, so user search doesn't scan the users table.
+#
+#   - a trie over lowercased names answers prefix queries ("ali" -> alice)
+#   - an n-gram index (every 1-, 2- and 3-character substring) answers
+#     substring queries: a longer query is narrowed to the names sharing
+#     all of its trigrams, then checked for the full substring
+#
+# Every trie node also keeps the TOP_N most followed names below it, so
+# autocomplete is a walk down the prefix and nothing else. A change to a
+# name or its follower count re-ranks only the nodes on that name's path.
+#
+# Each database gets its own index, built from its users on first use and
+# kept current by users.new_user / delete_user / follow_user / unfollow_user
+# (both backends).
+
+NGRAM = 3
+TOP_N = 10
+
+# The database lock, not one of its own: users.follow_user and friends
+# update this while holding DB_LOCK, and building it reads the database
+_lock = DB_LOCK
+_indexes = weakref.WeakKeyDictionary()   # db -> UsernameIndex
+
+
+class _TrieNode:
+    __slots__ = ('children', 'names', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.names = set()   # usernames whose lowercased form ends here
+        self.top = []        # up to TOP_N (-followers, username) below here, best first
+
+
+def _sort_key(username):
+    """Case-insensitive order, the same order a walk of the trie yields."""
+    return username.lower(), username
+
+
+def _grams(key):
+    """Every distinct substring of `key` up to NGRAM characters long."""
+    return {key[i:i + n] for n in range(1, NGRAM + 1) for i in range(len(key) - n + 1)}
+
+
+class UsernameIndex:
+
+    def __init__(self, follower_counts=None):
+        self.root = _TrieNode()
+        self.grams = {}       # gram -> set of usernames containing it
+        self.followers = {}   # username -> follower count, for ranking
+        for username, count in (follower_counts or {}).items():
+            self._insert(username, count)
+        self._rank_subtree(self.root)
+
+    def _path(self, key):
+        """The nodes from the root down to `key`, or None if it isn't in the trie."""
+        path = [self.root]
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                return None
+            path.append(node)
+        return path
+
+    def _rank(self, node):
+        candidates = [(-self.followers[name], name) for name in node.names]
+        for child in node.children.values():
+            candidates += child.top
+        candidates.sort()
+        node.top = candidates[:TOP_N]
+
+    def _rank_subtree(self, node):
+        for child in node.children.values():
+            self._rank_subtree(child)
+        self._rank(node)
+
+    def _rank_path(self, path):
+        for node in reversed(path):
+            self._rank(node)
+
+    def _insert(self, username, followers):
+        key = username.lower()
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+        node.names.add(username)
+        self.followers[username] = followers
+        for gram in _grams(key):
+            self.grams.setdefault(gram, set()).add(username)
+
+    def add(self, username, followers=0):
+        self._insert(username, followers)
+        self._rank_path(self._path(username.lower()))
+
+    def remove(self, username):
+        key = username.lower()
+        path = self._path(key)
+        if path is None or username not in path[-1].names:
+            return
+        path[-1].names.discard(username)
+        del self.followers[username]
+
+        # Prune branches that no longer lead to any name
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.names or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+            path.pop()
+        self._rank_path(path)
+
+        for gram in _grams(key):
+            names = self.grams.get(gram)
+            if names is not None:
+                names.discard(username)
+                if not names:
+                    del self.grams[gram]
+
+    def change_followers(self, username, delta):
+        if username not in self.followers:
+            return
+        self.followers[username] = max(self.followers[username] + delta, 0)
+        self._rank_path(self._path(username.lower()))
+
+    def top(self, prefix, limit=TOP_N):
+        """The `limit` most followed usernames starting with `prefix`, with counts."""
+        path = self._path(prefix.lower())
+        if path is None:
+            return []
+        return [(name, -negated) for negated, name in path[-1].top[:limit]]
+
+    def prefixed(self, prefix):
+        """Usernames starting with `prefix` (case-insensitive), in sorted order."""
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield from sorted(node.names)
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+
+    def containing(self, query):
+        """Usernames containing `query` (case-insensitive), in sorted order."""
+        key = query.lower()
+        if len(key) <= NGRAM:
+            return sorted(self.grams.get(key, ()), key=_sort_key)
+
+        candidates = None
+        for gram in {key[i:i + NGRAM] for i in range(len(key) - NGRAM + 1)}:
+            names = self.grams.get(gram)
+            if not names:
+                return []
+            candidates = set(names) if candidates is None else candidates & names
+        return sorted((name for name in candidates if key in name.lower()), key=_sort_key)
+
+
+def _for_db(db):
+    """The index for `db`, built from its users table the first time. Caller holds _lock."""
+    index = _indexes.get(db)
+    if index is None:
+        index = _indexes[db] = UsernameIndex(
+            {user['username']: user.get('follower_count', 0) for user in users.get_all_users(db)})
+    return index
+
+
+def _take(names, skip, limit):
+    matches = []
+    for name in names:
+        if name in skip:
+            continue
+        matches.append(name)
+        if limit and len(matches) >= limit:
+            break
+    return matches
+
+
+def prefixed(db, prefix, skip=(), limit=None):
+    """Up to `limit` usernames starting with `prefix`, sorted, leaving out `skip`."""
+    with _lock:
+        return _take(_for_db(db).prefixed(prefix), skip, limit)
+
+
+def containing(db, query, skip=(), limit=None):
+    """Up to `limit` usernames containing `query`, sorted, leaving out `skip`."""
+    with _lock:
+        return _take(_for_db(db).containing(query), skip, limit)
+
+
+def top_prefixed(db, prefix, limit=TOP_N):
+    """The `limit` (at most TOP_N) most followed (username, follower_count) pairs for `prefix`."""
+    with _lock:
+        return _for_db(db).top(prefix, limit)
+
+
+def user_added(db, username):
+    with _lock:
+        index = _indexes.get(db)
+        if index is not None:
+            index.add(username)
+
+
+def user_removed(db, username):
+    with _lock:
+        index = _indexes.get(db)
+        if index is not None:
+            index.remove(username)
+
+
+def followers_changed(db, username, delta):
+    with _lock:
+        index = _indexes.get(db)
+        if index is not None:
+            index.change_followers(username, delta)
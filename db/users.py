@@ -1,55 +1,115 @@
+import collections
+import heapq
+
 import tinydb
+from tinydb.table import Document
+
+from db import graph, helpers, timelines, user_index
+
 # Define the Query object once at the top, globally
 User = tinydb.Query()
+Follow = tinydb.Query()
 
 # --- All other code follows ---
 
+@helpers.dispatch
 def new_user(db, username, password):
     """
     Creates a new user with the new *follow-only* data structure.
     """
     users = db.table('users')
-    if users.get(User.username == username):
-        return None
-    
     user_record = {
         'username': username,
         'password': password,
-        'following': [],  # Users I am following
-        'followers': []   # Users who are following me
+        'follower_count': 0,   # Users following me
+        'following_count': 0   # Users I am following
     }
-    return users.insert(user_record)
 
+    # One lock around the check and the insert, so two signups for the
+    # same name can't both get through
+    with helpers.DB_LOCK:
+        if users.get(User.username == username):
+            return None
+        # Who follows whom lives in the 'follows' table
+        user_id = users.insert(user_record)
+        user_index.user_added(db, username)
+        graph.user_added(db, user_id, username)
+    return user_id
+
+@helpers.dispatch
 def get_user(db, username, password):
     """Gets a user document by username and password."""
     users = db.table('users')
     return users.get((User.username == username) &
                      (User.password == password))
 
+@helpers.dispatch
 def get_user_by_name(db, username):
     """Gets a user document by only their username."""
     users = db.table('users')
     # REMOVE: User = tinydb.Query()
     return users.get(User.username == username)
 
+@helpers.dispatch
+def get_all_users(db):
+    """Gets every user document."""
+    return db.table('users').all()
+
+@helpers.dispatch
 def delete_user(db, username, password):
     """Deletes a user."""
     users = db.table('users')
-    # REMOVE: User = tinydb.Query()
-    return users.remove((User.username == username) &
-                        (User.password == password))
+    follows = db.table('follows')
+
+    # A follow racing the delete can't leave an edge to a deleted user
+    with helpers.DB_LOCK:
+        # REMOVE: User = tinydb.Query()
+        removed = users.remove((User.username == username) &
+                               (User.password == password))
+        if not removed:
+            return removed
+
+        # Drop their edges and take them out of everyone else's counts
+        followees = get_following_names(db, username)
+        followers = get_follower_names(db, username)
+        follows.remove(Follow.follower == username)
+        follows.remove(Follow.followee == username)
+        for names, field in ((followees, 'follower_count'), (followers, 'following_count')):
+            doc_ids = [doc.doc_id for doc in get_users_by_names(db, names, fields=())]
+            if doc_ids:
+                users.update(_adjust_count(field, -1), doc_ids=doc_ids)
+
+        followees = get_users_by_names(db, followees, fields=('username', 'follower_count'))
+        for followee in followees:
+            user_index.followers_changed(db, followee['username'], -1)
+        user_index.user_removed(db, username)
+        graph.user_removed(db, removed[0])
+
+    for followee in followees:
+        timelines.followers_lost(db, followee['username'], followee['follower_count'])
+    # Their followers' timelines still hold their posts, as after an unfollow
+    for name in followers + [username]:
+        timelines.invalidate(db, name)
+    return removed
 
 # --- GONE: All send_request, accept_request, reject_request, remove_user_friend functions ---
 
 
 # --- FOLLOW/UNFOLLOW FUNCTIONS (These are now the primary actions) ---
 
+def _adjust_count(field, delta):
+    """A TinyDB update transform that moves a user's follow count by `delta`."""
+    def transform(doc):
+        doc[field] = max(doc.get(field, 0) + delta, 0)
+    return transform
+
+@helpers.dispatch
 def follow_user(db, follower_user, user_to_follow_name):
     """
     Adds a one-way follow relationship.
     """
     users = db.table('users')
-    User = tinydb.Query()
+    follows = db.table('follows')
     
     user_to_follow = get_user_by_name(db, user_to_follow_name)
     
@@ -59,153 +119,209 @@ def follow_user(db, follower_user, user_to_follow_name):
     if user_to_follow_name == follower_user['username']:
         return "You cannot follow yourself.", 'warning'
     
-    follower_following = follower_user.get('following', [])
-    
-    if user_to_follow_name in follower_following:
-        return f"You are already following {user_to_follow_name}.", 'info'
+    # The check and the writes happen under one lock, so two concurrent
+    # follows can't both add the edge
+    with helpers.DB_LOCK:
+        if graph.follows(db, follower_user.doc_id, user_to_follow.doc_id):
+            return f"You are already following {user_to_follow_name}.", 'info'
 
-    # --- Action ---
-    # 1. Add to follower's "following" list
-    follower_following.append(user_to_follow_name)
-    
-    # 2. Add to followed user's "followers" list
-    user_to_follow.setdefault('followers', []).append(follower_user['username'])
-    
-    # Update both users in the database
-    users.upsert(follower_user, User.username == follower_user['username'])
-    users.upsert(user_to_follow, User.username == user_to_follow['username'])
+        # --- Action ---
+        # One small edge document; neither user document grows
+        follows.insert({'follower': follower_user['username'], 'followee': user_to_follow_name})
+        users.update(_adjust_count('following_count', 1), doc_ids=[follower_user.doc_id])
+        users.update(_adjust_count('follower_count', 1), doc_ids=[user_to_follow.doc_id])
+
+        user_index.followers_changed(db, user_to_follow_name, 1)
+        graph.followed(db, follower_user.doc_id, user_to_follow.doc_id)
+    follower_user['following_count'] = follower_user.get('following_count', 0) + 1
+
+    # The follower's home timeline now has a new author in it
+    timelines.invalidate(db, follower_user['username'])
     
     return f"You are now following {user_to_follow_name}.", 'success'
 
+@helpers.dispatch
 def unfollow_user(db, follower_user, user_to_unfollow_name):
     """
     Removes a one-way follow relationship.
     """
     users = db.table('users')
-    User = tinydb.Query()
-    
-    user_to_unfollow = get_user_by_name(db, user_to_unfollow_name)
-    follower_following = follower_user.get('following', [])
+    follows = db.table('follows')
 
-    # --- Validation ---
-    if user_to_unfollow_name not in follower_following:
-        return "You are not following this user.", 'warning'
+    with helpers.DB_LOCK:
+        # --- Validation ---
+        removed = follows.remove((Follow.follower == follower_user['username']) &
+                                 (Follow.followee == user_to_unfollow_name))
+        if not removed:
+            return "You are not following this user.", 'warning'
+
+        # --- Action ---
+        # Counts move by the edges actually removed
+        lost = len(removed)
+        users.update(_adjust_count('following_count', -lost), doc_ids=[follower_user.doc_id])
+
+        user_to_unfollow = get_user_by_name(db, user_to_unfollow_name)
+        if user_to_unfollow:
+            users.update(_adjust_count('follower_count', -lost), doc_ids=[user_to_unfollow.doc_id])
+            user_index.followers_changed(db, user_to_unfollow_name, -lost)
+            graph.unfollowed(db, follower_user.doc_id, user_to_unfollow.doc_id)
+            follower_count = max(user_to_unfollow.get('follower_count', 0) - lost, 0)
+    follower_user['following_count'] = max(follower_user.get('following_count', 0) - lost, 0)
 
-    # --- Action ---
-    # 1. Remove from follower's "following" list
-    follower_following.remove(user_to_unfollow_name)
-    
-    # 2. Remove from unfollowed user's "followers" list
-    if user_to_unfollow:
-        user_followers = user_to_unfollow.get('followers', [])
-        if follower_user['username'] in user_followers:
-            user_followers.remove(follower_user['username'])
-            
-    # Update both users
-    users.upsert(follower_user, User.username == follower_user['username'])
     if user_to_unfollow:
-        users.upsert(user_to_unfollow, User.username == user_to_unfollow['username'])
+        timelines.followers_lost(db, user_to_unfollow_name, follower_count, lost)
+    timelines.invalidate(db, follower_user['username'])
         
     return f"You are no longer following {user_to_unfollow_name}.", 'success'
 
+@helpers.dispatch
+def get_following_names(db, username):
+    """Usernames of everyone `username` follows."""
+    return [edge['followee'] for edge in db.table('follows').search(Follow.follower == username)]
+
+@helpers.dispatch
+def get_follower_names(db, username):
+    """Usernames of everyone following `username`."""
+    return [edge['follower'] for edge in db.table('follows').search(Follow.followee == username)]
+
+@helpers.dispatch
+def get_follow_edges(db):
+    """Every (follower, followee) pair of usernames."""
+    return [(edge['follower'], edge['followee']) for edge in db.table('follows')]
+
+@helpers.dispatch
+def move_follow_lists(db):
+    """
+    Moves 'following'/'followers' lists stored inside user documents (the
+    old layout) into the 'follows' table, and gives every user stored
+    follower_count/following_count fields. Returns how many users changed.
+    """
+    users = db.table('users')
+    follows = db.table('follows')
+
+    with helpers.DB_LOCK:
+        stale = users.search(User.following.exists() | User.followers.exists() |
+                             ~User.follower_count.exists() | ~User.following_count.exists())
+        if not stale:
+            return 0
+
+        # Lists were kept on both ends; take the union, minus deleted users
+        usernames = {user['username'] for user in users}
+        existing = set(get_follow_edges(db))
+        edges = set(existing)
+        for user in stale:
+            edges.update((user['username'], name) for name in user.get('following', []))
+            edges.update((name, user['username']) for name in user.get('followers', []))
+        edges = {(a, b) for a, b in edges if a in usernames and b in usernames and a != b}
+        follows.insert_multiple({'follower': a, 'followee': b} for a, b in sorted(edges - existing))
+
+        follower_counts = collections.Counter(b for _, b in edges)
+        following_counts = collections.Counter(a for a, _ in edges)
+
+        def transform(doc):
+            doc.pop('following', None)
+            doc.pop('followers', None)
+            doc['follower_count'] = follower_counts[doc['username']]
+            doc['following_count'] = following_counts[doc['username']]
+        users.update(transform, doc_ids=[user.doc_id for user in stale])
+
+    return len(stale)
+
 
 # --- NEW HELPER FUNCTIONS FOR FETCHING LISTS ---
 
-def get_user_friends(db, user):
+# What the user lists on the friends pages show. Passwords stay out of it.
+USER_FIELDS = ('username', 'follower_count', 'following_count')
+
+@helpers.dispatch
+def get_users_by_names(db, names, fields=USER_FIELDS):
+    """
+    Resolves any number of usernames in one pass over the username index.
+    Returns one document per known name, in the order given, holding only
+    `fields` (and the doc_id).
+    """
+    return [Document({field: doc[field] for field in fields if field in doc}, doc.doc_id)
+            for doc in db.table('users').lookup('username', names)]
+
+def _names_sorted(db, user_ids, limit=None):
+    """Usernames for `user_ids` by name, only the first `limit` if given."""
+    names = graph.usernames(db, user_ids)
+    if limit is not None:
+        return heapq.nsmallest(limit, names, key=str.lower)
+    return sorted(names, key=str.lower)
+
+@helpers.dispatch
+def get_user_friends(db, user, limit=None):
     """
     Gets user docs for MUTUAL follows (A follows B and B follows A).
     This is the new definition of "Friends".
     """
-    users = db.table('users')
-    User = tinydb.Query()
-    
-    # Use sets for efficient intersection
-    following = set(user.get('following', []))
-    followers = set(user.get('followers', []))
-    
-    mutual_friend_names = following.intersection(followers)
-    
-    friends = []
-    for friend_name in mutual_friend_names:
-        friend_doc = users.get(User.username == friend_name)
-        if friend_doc:
-            friends.append(friend_doc)
-    return friends
+    return get_users_by_names(db, _names_sorted(db, graph.mutuals(db, user.doc_id), limit))
 
-def get_user_following(db, user):
+@helpers.dispatch
+def get_user_following(db, user, limit=None):
     """
     Gets user docs for people the user follows, but who DO NOT follow back.
     """
-    users = db.table('users')
-    User = tinydb.Query()
-    
-    following = set(user.get('following', []))
-    followers = set(user.get('followers', []))
-    
-    # People I follow minus people who follow me
-    following_only_names = following - followers
-    
-    following_list = []
-    for user_name in following_only_names:
-        user_doc = users.get(User.username == user_name)
-        if user_doc:
-            following_list.append(user_doc)
-    return following_list
+    return get_users_by_names(db, _names_sorted(db, graph.following_only(db, user.doc_id), limit))
 
-def get_user_followers(db, user):
+@helpers.dispatch
+def get_user_followers(db, user, limit=None):
     """
     Gets user docs for people who follow the user, but who the user DOES NOT follow back.
     """
-    users = db.table('users')
-    User = tinydb.Query()
-    
-    following = set(user.get('following', []))
-    followers = set(user.get('followers', []))
-    
-    # People who follow me minus people I follow
-    followers_only_names = followers - following
-    
-    followers_list = []
-    for user_name in followers_only_names:
-        user_doc = users.get(User.username == user_name)
-        if user_doc:
-            followers_list.append(user_doc)
-    return followers_list
+    return get_users_by_names(db, _names_sorted(db, graph.followers_only(db, user.doc_id), limit))
+
+def get_relationship_counts(db, user):
+    """Sizes of the friends, following-only and followers-only lists."""
+    return graph.relationship_counts(db, user.doc_id)
 
+def _page(names, limit):
+    """(names, next_cursor) from up to limit + 1 names in order."""
+    return names[:limit], (names[limit - 1] if len(names) > limit else None)
 
+@helpers.dispatch
+def get_followers_page(db, username, after=None, limit=50):
+    """
+    One page of the usernames following `username`, in name order,
+    starting after the name `after`. Returns (names, next_cursor), where
+    next_cursor is None on the last page. Only that page is read.
+    """
+    edges = db.table('follows').ascending(
+        'follower', limit + 1, after=after, partition=('followee', username))
+    return _page([edge['follower'] for edge in edges], limit)
+
+@helpers.dispatch
+def get_following_page(db, username, after=None, limit=50):
+    """Like get_followers_page, for the usernames `username` follows."""
+    edges = db.table('follows').ascending(
+        'followee', limit + 1, after=after, partition=('follower', username))
+    return _page([edge['followee'] for edge in edges], limit)
+
+
+@helpers.dispatch
+def find_users(db, query, exclude=(), limit=None):
+    """
+    User docs whose username contains `query` (case-insensitive), sorted
+    by name. Answered from the username index, not a table scan.
+    """
+    if not query:
+        return []
+    return get_users_by_names(db, user_index.containing(db, query, skip=set(exclude), limit=limit))
+
+
+@helpers.dispatch
 def get_potential_friends(db, user, query=None, limit=None):
     """
     Finds all users who the current user is NOT already following.
     (This suggests people to follow).
     """
-    users = db.table('users')
-    all_users = users.all()
-    
-    current_username = user['username']
-    
-    # Create a set of all usernames to exclude
     # We only exclude people we are ALREADY following, and ourselves.
-    exclude_list = set(user.get('following', []))
-    exclude_list.add(current_username)
-    
-    potential_friends = []
-    for potential_user in all_users:
-        potential_username = potential_user['username']
-        
-        # Skip if user is in the exclude list
-        if potential_username in exclude_list:
-            continue
-            
-        # If there's a search query, check if it matches
-        if query:
-            if query.lower() not in potential_username.lower():
-                continue # Query doesn't match, skip
-        
-        # If we get here, the user is a valid potential friend
-        potential_friends.append(potential_user)
-        
-        # If a limit is set and we've reached it, stop
-        if limit and len(potential_friends) >= limit:
-            break
-            
-    return potential_friends
\ No newline at end of file
+    exclude_list = set(get_following_names(db, user['username']))
+    exclude_list.add(user['username'])
+
+    if query:
+        names = user_index.containing(db, query, skip=exclude_list, limit=limit)
+    else:
+        names = user_index.prefixed(db, '', skip=exclude_list, limit=limit)
+    return get_users_by_names(db, names)
\ No newline at end of file
@@ -0,0 +1,211 @@
+import flask
+
+from db import feed_cache, search, user_index, users, helpers, posts as db_posts
+
+# JSON endpoints for client-side rendering. Everything here lives under /api.
+blueprint = flask.Blueprint("api", __name__, url_prefix='/api')
+
+FEED_PAGE_SIZE = 20
+MAX_FEED_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20
+FOLLOW_PAGE_SIZE = 50
+MAX_FOLLOW_PAGE_SIZE = 200
+
+
+def _compact_post(post):
+    """The fields the feed needs to draw a post, and nothing else."""
+    return {
+        'id': post.doc_id,
+        'user': post['user'],
+        'text': post['text'],
+        'time': post['time'],
+        'like_count': post.get('like_count', 0),
+        'liked_by_user': post.get('liked_by_user', False),
+        'comment_count': post.get('comment_count', 0),
+    }
+
+
+@blueprint.route('/feed')
+def feed():
+    """
+    One page of the user's home feed as JSON, newest first.
+    '?before=<cursor>' asks for the page after a previous one and '?limit='
+    sets the page size. Responses carry an ETag, so a client polling with
+    If-None-Match gets a bodiless 304 while nothing has changed.
+    """
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to view the feed.'}), 401
+
+    limit = flask.request.args.get('limit', FEED_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_FEED_PAGE_SIZE)
+
+    before = db_posts.decode_cursor(flask.request.args.get('before'))
+    if before is None:
+        feed_posts, next_cursor = feed_cache.first_page(
+            db, user, limit, lambda: db_posts.get_timeline_page(db, user, limit=limit))
+    else:
+        feed_posts, next_cursor = db_posts.get_timeline_page(db, user, before=before, limit=limit)
+
+    resp = flask.jsonify({
+        'posts': [_compact_post(post) for post in feed_posts],
+        'next_cursor': db_posts.encode_cursor(next_cursor) if next_cursor else None,
+    })
+    # Per-user data: browsers may keep it but must revalidate every time
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.add_etag()
+    return resp.make_conditional(flask.request)
+
+
+@blueprint.route('/search')
+def search_posts():
+    """
+    Posts whose text or comments match '?q=', best match first, as JSON.
+    '?page=' (from 1) walks through the results SEARCH_PAGE_SIZE at a time.
+    """
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to search.'}), 401
+
+    query = flask.request.args.get('q', '')
+    page = max(flask.request.args.get('page', 1, type=int), 1)
+    results, total = search.search_posts(db, query, page=page, per_page=SEARCH_PAGE_SIZE)
+
+    return flask.jsonify({
+        'posts': [_compact_post(post) for post in results],
+        'total': total,
+        'page': page,
+        'has_more': page * SEARCH_PAGE_SIZE < total,
+    })
+
+
+@blueprint.route('/users/autocomplete')
+def autocomplete_users():
+    """
+    The most followed usernames starting with '?prefix=', for suggesting
+    names while someone types. '?limit=' asks for fewer than the default.
+    """
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to search for users.'}), 401
+
+    prefix = flask.request.args.get('prefix', '')
+    limit = flask.request.args.get('limit', user_index.TOP_N, type=int)
+    limit = min(max(limit, 1), user_index.TOP_N)
+
+    matches = user_index.top_prefixed(db, prefix, limit) if prefix else []
+    resp = flask.jsonify({
+        'users': [{'username': name, 'follower_count': count} for name, count in matches],
+    })
+    resp.headers['Cache-Control'] = 'private, max-age=30'
+    return resp
+
+
+def _follow_list(name, count_field, get_page):
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to view this list.'}), 401
+
+    found = users.get_users_by_names(db, [name])
+    if not found:
+        return flask.jsonify({'error': f"User '{name}' not found."}), 404
+
+    limit = flask.request.args.get('limit', FOLLOW_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_FOLLOW_PAGE_SIZE)
+    names, next_cursor = get_page(db, name, after=flask.request.args.get('after'), limit=limit)
+
+    return flask.jsonify({
+        'users': [dict(doc) for doc in users.get_users_by_names(db, names)],
+        'count': found[0].get(count_field, 0),
+        'next_cursor': next_cursor,
+    })
+
+
+@blueprint.route('/users/<name>/followers')
+def followers(name):
+    """
+    One page of the people following `name`, in name order, with the
+    stored follower_count as 'count'. '?after=<next_cursor>' asks for the
+    next page and '?limit=' sets the page size.
+    """
+    return _follow_list(name, 'follower_count', users.get_followers_page)
+
+
+@blueprint.route('/users/<name>/following')
+def following(name):
+    """Like /followers, for the people `name` follows."""
+    return _follow_list(name, 'following_count', users.get_following_page)
+
+
+@blueprint.route('/posts', methods=['POST'])
+def create_post():
+    """
+    Posts the 'post' form field (or JSON key) as the logged-in user and
+    returns the new post with 201, so the page can pull it into the feed
+    without a full reload.
+    """
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to post.'}), 401
+
+    text = flask.request.form.get('post') or (flask.request.get_json(silent=True) or {}).get('post')
+    if not text or not text.strip():
+        return flask.jsonify({'error': 'Post text is empty.'}), 400
+
+    post_id = db_posts.add_post(db, user, text)
+    return flask.jsonify(_compact_post(db_posts.get_post(db, post_id))), 201
+
+
+@blueprint.route('/posts/<int:post_id>/like', methods=['POST'])
+def like(post_id):
+    """
+    Likes or unlikes a post for the logged-in user ('action' is 'like' or
+    'unlike') and returns the post's new like_count and liked state.
+    """
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to like a post.'}), 401
+
+    action = flask.request.form.get('action') or (flask.request.get_json(silent=True) or {}).get('action')
+    if action == 'like':
+        db_posts.like_post(db, user.doc_id, post_id)
+    elif action == 'unlike':
+        db_posts.unlike_post(db, user.doc_id, post_id)
+    else:
+        return flask.jsonify({'error': "action must be 'like' or 'unlike'."}), 400
+
+    # Read back rather than assume: liking twice changes nothing
+    state = db_posts.get_like_state(db, user.doc_id, post_id)
+    if state is None:
+        return flask.jsonify({'error': f'Post with ID {post_id} not found.'}), 404
+
+    like_count, liked = state
+    return flask.jsonify({
+        'id': post_id,
+        'like_count': like_count,
+        'liked': liked,
+    }), 200
@@ -2,11 +2,17 @@ import flask
 
 # Assuming these imports are correct based on your previous code structure
 from handlers import copy
-from db import posts, users, helpers
+from handlers.streaming import render_streamed
+from db import posts, recommendations, users, helpers
 
 # Initialize the Flask Blueprint
 blueprint = flask.Blueprint("friends", __name__)
 
+# Each relationship list on the friends page shows at most this many
+# people; the full lists are paged through /api/users/<name>/followers
+# and /following
+LIST_LIMIT = 50
+
 # --- GONE: All send_request, accept_request, reject_request, unfriend routes ---
 
 
@@ -77,12 +83,14 @@ def view_friend(fname):
         return flask.redirect(flask.url_for('login.loginscreen'))
 
     # Renamed 'friend' to 'profile_user' for clarity
-    profile_user = users.get_user_by_name(db, fname)
-    if not profile_user:
+    found = users.get_users_by_names(db, [fname])
+    if not found:
         flask.flash(f"User '{fname}' not found.", 'danger')
         return flask.redirect(flask.url_for('friends.friends_list')) 
+    profile_user = found[0]
 
-    all_posts = posts.get_posts(db, profile_user)[::-1] # reverse order
+    # Newest first, straight from the per-author time index
+    all_posts = posts.get_recent_posts(db, profile_user['username'])
 
     return flask.render_template(
         'friend.html', 
@@ -92,9 +100,10 @@ def view_friend(fname):
         username=username,
         friend=profile_user['username'], # template might still use 'friend'
         # Pass the new lists to the template
-        friends=users.get_user_friends(db, user), 
-        following=users.get_user_following(db, user),
-        followers=users.get_user_followers(db, user),
+        friends=users.get_user_friends(db, user, limit=LIST_LIMIT), 
+        following=users.get_user_following(db, user, limit=LIST_LIMIT),
+        followers=users.get_user_followers(db, user, limit=LIST_LIMIT),
+        counts=users.get_relationship_counts(db, user),
         posts=all_posts,
         active_page='friends' 
     )
@@ -112,14 +121,15 @@ def friends_list():
         return flask.redirect(flask.url_for('login.loginscreen'))
 
     # --- Get the three new lists ---
-    friends = users.get_user_friends(db, user) # Mutuals
-    following = users.get_user_following(db, user) # People I follow
-    followers = users.get_user_followers(db, user) # People following me
+    friends = users.get_user_friends(db, user, limit=LIST_LIMIT) # Mutuals
+    following = users.get_user_following(db, user, limit=LIST_LIMIT) # People I follow
+    followers = users.get_user_followers(db, user, limit=LIST_LIMIT) # People following me
     
-    # This now correctly gets only users the user is NOT following
-    potential_friends = users.get_potential_friends(db, user, limit=5)
+    following_names = set(users.get_following_names(db, username))
+    # Precomputed in the background (see recommendations.start_refresher)
+    potential_friends = recommendations.suggested_users(db, user, following_names, limit=5)
 
-    return flask.render_template(
+    return render_streamed(
         'friends.html', 
         title=copy.title,
         subtitle=copy.subtitle, 
@@ -128,7 +138,9 @@ def friends_list():
         friends=friends,
         following=following,
         followers=followers,
+        counts=users.get_relationship_counts(db, user),
         potential_friends=potential_friends,
+        following_names=following_names,
         active_page='friends' 
     )
     
@@ -151,23 +163,16 @@ def find_users():
     query = flask.request.args.get('query', '')
     
     # --- Fetch all necessary data for the template ---
-    friends = users.get_user_friends(db, user)
-    following = users.get_user_following(db, user)
-    followers = users.get_user_followers(db, user)
+    friends = users.get_user_friends(db, user, limit=LIST_LIMIT)
+    following = users.get_user_following(db, user, limit=LIST_LIMIT)
+    followers = users.get_user_followers(db, user, limit=LIST_LIMIT)
     
     # --- NEW SEARCH LOGIC ---
-    # Search all users in the DB
-    all_users = db.table('users').all()
-    search_results = []
-    if query:
-        for u in all_users:
-            # Add if query matches and is NOT the user themselves
-            if query.lower() in u['username'].lower() and u['username'] != user['username']:
-                search_results.append(u)
-    else:
-        search_results = []
-        
-    return flask.render_template(
+    # Matching names come from the username index; the user themselves is
+    # left out, and a short query shows only the first LIST_LIMIT matches
+    search_results = users.find_users(db, query, exclude=[user['username']], limit=LIST_LIMIT)
+
+    return render_streamed(
         'friends.html', # Fixed typo: 'freinds.html' -> 'friends.html'
         title=copy.title,
         subtitle=copy.subtitle, 
@@ -176,7 +181,9 @@ def find_users():
         friends=friends,
         following=following,
         followers=followers,
+        counts=users.get_relationship_counts(db, user),
         search_results=search_results, # Pass the new search results
         query=query,
+        following_names=set(users.get_following_names(db, username)),
         active_page='friends' 
     )
\ No newline at end of file
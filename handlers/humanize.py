@@ -0,0 +1,44 @@
+import datetime
+import functools
+import time
+
+import timeago
+
+# timeago only ever shows one unit ("5 minutes ago", "3 days ago"), so
+# every timestamp whose age falls in the same bucket of that unit gets the
+# same text. Ages are rounded down to their bucket and each bucket is
+# formatted once; the cache holds at most a few thousand short strings.
+# Timestamps ahead of the clock (skew between writers) are bucketed the
+# same way by distance and keep timeago's "in 5 minutes".
+#
+# Up to a month the text is exactly what timeago.format gives. Past that,
+# timeago's months are 30.4 days long, so a post can flip to "N months
+# ago" up to a day later than it would have.
+_BUCKETS = [
+    (60, 1),            # under a minute: seconds
+    (60 * 60, 60),      # under an hour: minutes
+    (24 * 60 * 60, 60 * 60),
+]
+_DAY = 24 * 60 * 60
+
+
+def _bucket(elapsed):
+    for limit, size in _BUCKETS:
+        if elapsed < limit:
+            return elapsed - elapsed % size
+    return elapsed - elapsed % _DAY
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_bucket(seconds):
+    return timeago.format(datetime.timedelta(seconds=seconds))
+
+
+def time_ago(timestamp, now=None):
+    """'5 minutes ago' for a Unix timestamp, or 'in 5 minutes' for one ahead of `now`."""
+    if now is None:
+        now = time.time()
+    elapsed = int(now - timestamp)
+    if elapsed < 0:
+        return _format_bucket(-_bucket(-elapsed))
+    return _format_bucket(_bucket(elapsed))
@@ -1,6 +1,5 @@
 import flask
-from db import helpers
-import tinydb
+from db import helpers, users, posts
 
 blueprint = flask.Blueprint("leaderboard", __name__)
 
@@ -17,13 +16,8 @@ def leaderboard_page():
     db = helpers.load_db()
     
     # Load all tables
-    users_table = db.table('users')
-    posts_table = db.table('posts')
-    likes_table = db.table('likes')
-
-    all_users = users_table.all()
-    all_posts = posts_table.all()
-    all_likes = likes_table.all()
+    all_users = users.get_all_users(db)
+    all_posts = posts.get_all_posts(db)
 
     # 1. Initialize Score Dictionary
     # Format: {'username': {'username': 'name', 'points': 0, 'followers': 0}}
@@ -31,7 +25,7 @@ def leaderboard_page():
     
     for user in all_users:
         username = user['username']
-        follower_count = len(user.get('followers', []))
+        follower_count = user.get('follower_count', 0)
         
         leaderboard_data[username] = {
             'username': username,
@@ -46,42 +40,30 @@ def leaderboard_page():
         # Apply Points for Followers
         leaderboard_data[username]['points'] += (follower_count * POINTS_PER_FOLLOWER)
 
-    # 2. Calculate Post Points & Map Post IDs to Owners
-    # We need to know who owns which post_id to give them points for likes later
-    post_owner_map = {} 
-
+    # 2. Calculate Post Points
+    # Like and comment totals are stored on each post, so the likes table
+    # never has to be loaded here
     for post in all_posts:
         owner = post.get('user')
-        post_id = post.doc_id
         
         # Skip if user was deleted but post remains
         if owner not in leaderboard_data:
             continue
 
-        post_owner_map[post_id] = owner
-
         # Points for making a post
         leaderboard_data[owner]['points'] += POINTS_PER_POST_MADE
 
         # Points for comments received on this post
-        comments = post.get('comments', [])
-        comment_count = len(comments)
+        comment_count = post.get('comment_count', 0)
         leaderboard_data[owner]['stats']['comments'] += comment_count
         leaderboard_data[owner]['points'] += (comment_count * POINTS_PER_COMMENT_RECEIVED)
 
-    # 3. Calculate Like Points
-    for like in all_likes:
-        post_id = like.get('post_id')
-        
-        # Find who owns the post that was liked
-        if post_id in post_owner_map:
-            owner = post_owner_map[post_id]
-            
-            # Give points to the owner of the post (not the person who clicked like)
-            leaderboard_data[owner]['stats']['likes'] += 1
-            leaderboard_data[owner]['points'] += POINTS_PER_LIKE_RECEIVED
+        # Give points to the owner of the post (not the person who clicked like)
+        like_count = post.get('like_count', 0)
+        leaderboard_data[owner]['stats']['likes'] += like_count
+        leaderboard_data[owner]['points'] += (like_count * POINTS_PER_LIKE_RECEIVED)
 
-    # 4. Convert to List and Sort
+    # 3. Convert to List and Sort
     # Turn the dictionary values into a list: [UserA, UserB, UserC...]
     final_list = list(leaderboard_data.values())
     
@@ -91,7 +73,7 @@ def leaderboard_page():
     # Get current user data for the header
     username = flask.request.cookies.get('username')
 
-    # 5. Render Template
+    # 4. Render Template
     # We pass the top 3 separately for the podium, and the rest for the list
     return flask.render_template(
         'leaderboard.html',
@@ -1,10 +1,14 @@
 import flask
 
 from handlers import copy
-from db import users, helpers, posts as db_posts
+from handlers.streaming import render_streamed
+from db import feed_cache, users, helpers, posts as db_posts
 
 blueprint = flask.Blueprint("login", __name__)
 
+# How many posts the feed shows per page
+FEED_PAGE_SIZE = 20
+
 @blueprint.route('/loginscreen')
 def loginscreen():
     """Present a form to the user to enter their username and password."""
@@ -119,25 +123,29 @@ def index():
     # DEBUG: Print friends list to verify
     print(f"Friends fetched: {[f['username'] for f in friends]}")
     
-    # NEW FIX: Fetch ALL valid posts from the entire database, 
-    # since friend lists are currently empty.
-    all_posts = db_posts.get_all_valid_posts(db)
+    # Fetch one page of the user's home timeline (their posts and posts by
+    # people they follow), newest first. '?before=<cursor>' asks for the
+    # page after a previous one. The first page is cached per user until
+    # something on it changes.
+    before = db_posts.decode_cursor(flask.request.args.get('before'))
+    if before is None:
+        feed_posts, next_cursor = feed_cache.first_page(
+            db, user, FEED_PAGE_SIZE, lambda: db_posts.get_timeline_page(db, user, limit=FEED_PAGE_SIZE))
+    else:
+        feed_posts, next_cursor = db_posts.get_timeline_page(
+            db, user, before=before, limit=FEED_PAGE_SIZE)
     
-    # DEBUG: Total count
-    print(f"Total valid posts found across ALL users: {len(all_posts)}")
+    # DEBUG: Page size
+    print(f"Posts on this page: {len(feed_posts)}")
     print("------------------------------------------\n")
-    
-    # 3. Sort Posts
-    # Sort the aggregated list of posts by 'time', newest first
-    sorted_posts = sorted(all_posts, key=lambda post: post['time'], reverse=True)
 
-    # 4. Render Template
+    # 3. Render Template (streamed: the header and sidebar go out first)
     # Using getattr for config variables ensures a fallback if the copy module is missing data
-    return flask.render_template('feed.html', 
+    return render_streamed('feed.html', 
                                  title=getattr(copy, 'title', 'Celebrity Feed'),
                                  subtitle=getattr(copy, 'subtitle', 'Latest Gossip'), 
                                  user=user, 
                                  username=username,
                                  friends=friends, 
-                                 posts=sorted_posts)
-
+                                 posts=feed_posts,
+                                 next_cursor=db_posts.encode_cursor(next_cursor) if next_cursor else None)
@@ -1,10 +1,13 @@
 import time
-import timeago
 import flask
 from db import users, helpers, posts as db_posts
+from handlers.humanize import time_ago
 
 blueprint = flask.Blueprint("posts", __name__)
 
+# Comments loaded per click on "load more" in a post's comment section
+COMMENT_PAGE_SIZE = 20
+
 @blueprint.route('/post', methods=['POST'])
 def post():
     """Creates a new post."""
@@ -63,7 +66,31 @@ def post_comment(post_id):
     new_comment_data = db_posts.add_comment(db, post_id, username, comment_text)
 
     if new_comment_data:
-        new_comment_data['time'] = timeago.format(new_comment_data['time'], time.time())
+        new_comment_data['time'] = time_ago(new_comment_data['time'])
         return flask.jsonify(new_comment_data), 200
     else:
         return flask.jsonify({'error': f'Post with ID {post_id} not found.'}), 404
+
+@blueprint.route('/comments/<int:post_id>')
+def list_comments(post_id):
+    """Returns one page of a post's comments as JSON, oldest first."""
+    db = helpers.load_db()
+    username = flask.request.cookies.get('username')
+    password = flask.request.cookies.get('password')
+    user = users.get_user(db, username, password)
+
+    if not user:
+        return flask.jsonify({'error': 'Unauthorized: Please log in to read comments.'}), 401
+
+    # '?after=<cursor>' asks for the page after a previous one
+    after = db_posts.decode_cursor(flask.request.args.get('after'))
+    comments, next_cursor = db_posts.get_comments_page(db, post_id, after=after, limit=COMMENT_PAGE_SIZE)
+
+    now = time.time()
+    return flask.jsonify({
+        'comments': [
+            {'user': comment['user'], 'text': comment['text'], 'time': time_ago(comment['time'], now)}
+            for comment in comments
+        ],
+        'next_cursor': db_posts.encode_cursor(next_cursor) if next_cursor else None,
+    }), 200
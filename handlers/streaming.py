@@ -0,0 +1,35 @@
+import flask
+
+# How many of Jinja's small output strings are joined into each chunk of a
+# streamed page; sending them one by one costs a socket write per tag.
+STREAM_BUFFER_SIZE = 64
+
+
+def render_streamed(template_name, **context):
+    """
+    flask.stream_template, so the first bytes of a page go out before the
+    last post or user is rendered and the full page is never held in
+    memory, with its output batched into STREAM_BUFFER_SIZE chunks.
+
+    Set STREAM_TEMPLATES = False in the app config to render in one piece.
+    """
+    if not flask.current_app.config.get('STREAM_TEMPLATES', True):
+        return flask.render_template(template_name, **context)
+
+    # Flashed messages are popped from the session cookie, and cookies are
+    # sent with the headers, before any of the body. Read them now; the
+    # template gets the same list back from the request context.
+    flask.get_flashed_messages(with_categories=True)
+
+    return flask.Response(_batched(flask.stream_template(template_name, **context)))
+
+
+def _batched(chunks):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= STREAM_BUFFER_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
@@ -0,0 +1,54 @@
+import os
+import random
+import sys
+import time
+import timeit
+
+import timeago
+
+# Run from the project root: python tests/bench_convert_time.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers.humanize import time_ago
+
+# --- Configuration ---
+POSTS_PER_PAGE = 20
+COMMENTS_PER_POST = 5
+RENDERS = 2000
+MONTH = 30 * 24 * 60 * 60
+
+now = time.time()
+random.seed(1)
+
+# A feed page's worth of timestamps, mostly recent like a real feed
+timestamps = [now - random.expovariate(1 / 3600) for _ in range(POSTS_PER_PAGE * (1 + COMMENTS_PER_POST))]
+
+
+def render_timeago():
+    for ts in timestamps:
+        timeago.format(ts, now)
+
+
+def render_cached():
+    for ts in timestamps:
+        time_ago(ts, now)
+
+
+# --- Same text as timeago for everything within a month, either way ---
+# (negative ages are timestamps ahead of the clock)
+mismatches = 0
+ages = list(range(0, 3 * 60 * 60)) + [random.randrange(MONTH) for _ in range(20000)]
+for age in ages + [-age for age in ages]:
+    if time_ago(now - age, now) != timeago.format(now - age, now):
+        mismatches += 1
+print(f"Mismatches against timeago (ages within a month): {mismatches}")
+
+# --- Per-render cost ---
+plain = min(timeit.repeat(render_timeago, number=RENDERS, repeat=3)) / RENDERS
+cached = min(timeit.repeat(render_cached, number=RENDERS, repeat=3)) / RENDERS
+
+print(f"Timestamps per render: {len(timestamps)}")
+print(f"timeago.format:  {plain * 1e6:8.1f} us per render")
+print(f"time_ago:        {cached * 1e6:8.1f} us per render")
+print(f"Speedup:         {plain / cached:8.1f}x")
+
+sys.exit(1 if mismatches else 0)
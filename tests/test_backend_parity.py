@@ -0,0 +1,225 @@
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import graph, helpers, posts, recommendations, search, timelines, users
+from db.sqlite_store import SqliteDB
+from db.storage import WALStorage
+from db.tables import DB_LOCK, IndexedTable, WALTinyDB
+
+
+class BackendParityTest(unittest.TestCase):
+    """Runs each check against a TinyDB (WAL) and a SQLite database."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backends = {
+            'tinydb': WALTinyDB(os.path.join(self.tmp.name, 'db.json'), storage=WALStorage, lock=DB_LOCK),
+            'sqlite': SqliteDB(os.path.join(self.tmp.name, 'youface.db')),
+        }
+
+    def tearDown(self):
+        for db in self.backends.values():
+            db.close()
+        self.tmp.cleanup()
+
+    def new_user(self, db, username):
+        users.new_user(db, username, 'pw')
+        return users.get_user_by_name(db, username)
+
+    def test_post_without_text_is_stored_empty(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice = self.new_user(db, 'alice')
+                post_id = posts.add_post(db, alice, None)
+                self.assertEqual(posts.get_post(db, post_id)['text'], '')
+                self.assertEqual(posts.get_recent_posts(db, 'alice'), [])
+
+    def feed(self, db, user, limit=2):
+        """Every post_id on the user's timeline, paged `limit` at a time."""
+        post_ids, before = [], None
+        while True:
+            page, before = timelines.read_timeline(db, user, before=before, limit=limit)
+            post_ids += [post_id for _, post_id in page]
+            if before is None:
+                return post_ids
+
+    def test_timeline_pages_match(self):
+        feeds = {}
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice, bob, carol = (self.new_user(db, n) for n in ('alice', 'bob', 'carol'))
+                users.follow_user(db, alice, 'bob')
+                posts.add_post(db, bob, 'before the timeline is built')
+                posts.add_post(db, carol, 'not followed yet')
+                self.assertEqual(len(self.feed(db, alice)), 1)
+
+                # Fanned out onto the built timeline
+                for n in range(4):
+                    posts.add_post(db, bob, f'bob {n}')
+                posts.add_post(db, alice, 'my own post')
+                # Following rebuilds it with carol's posts
+                users.follow_user(db, alice, 'carol')
+                posts.add_post(db, carol, 'carol after follow')
+
+                feeds[name] = self.feed(db, alice)
+                self.assertEqual(len(feeds[name]), 8)
+                self.assertEqual(feeds[name], sorted(feeds[name], reverse=True))
+        self.assertEqual(feeds['tinydb'], feeds['sqlite'])
+
+    def test_former_celebrity_posts_stay_in_feeds(self):
+        threshold = helpers.CELEBRITY_FOLLOWERS
+        helpers.CELEBRITY_FOLLOWERS = 3
+        self.addCleanup(setattr, helpers, 'CELEBRITY_FOLLOWERS', threshold)
+
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                star = self.new_user(db, 'star')
+                fans = [self.new_user(db, f'fan{n}') for n in range(4)]
+                for fan in fans:
+                    users.follow_user(db, fan, 'star')
+                    timelines.read_timeline(db, fan)
+
+                # Skipped by fan-out, merged in at read time
+                post_id = posts.add_post(db, users.get_user_by_name(db, 'star'), 'hello fans')
+                self.assertIn(post_id, self.feed(db, fans[0]))
+
+                # 4 -> 3 followers: still a celebrity
+                users.unfollow_user(db, fans[3], 'star')
+                self.assertIn(post_id, self.feed(db, fans[0]))
+
+                # 3 -> 2 followers: below the threshold, so the post has to
+                # come from the stored timelines now
+                users.delete_user(db, 'fan2', 'pw')
+                self.assertIn(post_id, self.feed(db, fans[0]))
+                self.assertIn(post_id, self.feed(db, fans[1]))
+                self.assertIn(post_id, self.feed(db, star))
+
+    def test_concurrent_signups_create_one_user(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                # Widen the gap between the "name taken?" check and the insert
+                # (SQLite does both in one INSERT OR IGNORE)
+                patch = contextlib.nullcontext()
+                if name == 'tinydb':
+                    get = IndexedTable.get
+                    patch = mock.patch.object(IndexedTable, 'get', lambda *args, **kwargs:
+                                              (get(*args, **kwargs), time.sleep(0.01))[0])
+                threads = [threading.Thread(target=users.new_user, args=(db, 'alice', 'pw'))
+                           for _ in range(8)]
+                with patch:
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                self.assertEqual([user['username'] for user in users.get_all_users(db)], ['alice'])
+
+    def test_concurrent_follows_add_one_edge(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice = self.new_user(db, 'alice')
+                self.new_user(db, 'bob')
+                threads = [threading.Thread(target=users.follow_user,
+                                            args=(db, users.get_user_by_name(db, 'alice'), 'bob'))
+                           for _ in range(8)]
+                # Widen the gap between the "already following?" check and the insert
+                follows = graph.follows
+                with mock.patch.object(graph, 'follows',
+                                       lambda *args: time.sleep(0.01) or follows(*args)):
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                self.assertEqual(users.get_user_by_name(db, 'bob')['follower_count'], 1)
+                self.assertEqual(users.get_follower_names(db, 'bob'), ['alice'])
+
+                users.unfollow_user(db, alice, 'bob')
+                self.assertEqual(users.get_user_by_name(db, 'bob')['follower_count'], 0)
+                self.assertEqual(users.get_user_by_name(db, 'alice')['following_count'], 0)
+                self.assertEqual(users.get_follower_names(db, 'bob'), [])
+
+    def test_refresher_stores_suggestions(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice, bob, _ = (self.new_user(db, n) for n in ('alice', 'bob', 'carol'))
+                users.follow_user(db, alice, 'bob')
+                users.follow_user(db, bob, 'carol')
+                self.assertIsNone(recommendations.last_computed(db))
+
+                # Nothing stored yet, so the first refresh is due now
+                recommendations.start_refresher(db, interval=3600)
+                deadline = time.time() + 30
+                while recommendations.last_computed(db) is None and time.time() < deadline:
+                    time.sleep(0.05)
+                self.assertEqual(recommendations.get_suggestions(db, 'alice')[0][0], 'carol')
+
+    def test_like_state_is_read_back(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice = self.new_user(db, 'alice')
+                post_id = posts.add_post(db, alice, 'like me')
+                self.assertEqual(posts.get_like_state(db, alice.doc_id, post_id), (0, False))
+                posts.like_post(db, alice.doc_id, post_id)
+                posts.like_post(db, alice.doc_id, post_id)
+                self.assertEqual(posts.get_like_state(db, alice.doc_id, post_id), (1, True))
+                self.assertIsNone(posts.get_like_state(db, alice.doc_id, post_id + 100))
+
+    def test_deleted_authors_leave_feeds(self):
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice, bob = self.new_user(db, 'alice'), self.new_user(db, 'bob')
+                users.follow_user(db, alice, 'bob')
+                posts.add_post(db, bob, 'soon gone')
+                self.assertEqual(len(self.feed(db, alice)), 1)
+
+                users.delete_user(db, 'bob', 'pw')
+                self.assertEqual(self.feed(db, alice), [])
+
+    def test_comment_pages_match(self):
+        pages = {}
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice = self.new_user(db, 'alice')
+                first, second = posts.add_post(db, alice, 'first'), posts.add_post(db, alice, 'second')
+                for n in range(5):
+                    posts.add_comment(db, first, 'alice', f'comment {n}')
+                posts.add_comment(db, second, 'alice', 'elsewhere')
+
+                texts, after = [], None
+                while True:
+                    page, after = posts.get_comments_page(db, first, after=after, limit=2)
+                    texts.append([comment['text'] for comment in page])
+                    if after is None:
+                        break
+                pages[name] = texts
+                self.assertEqual(texts, [['comment 0', 'comment 1'], ['comment 2', 'comment 3'], ['comment 4']])
+        self.assertEqual(pages['tinydb'], pages['sqlite'])
+
+    def test_search_results_match(self):
+        results = {}
+        for name, db in self.backends.items():
+            with self.subTest(backend=name):
+                alice = self.new_user(db, 'alice')
+                posts.add_post(db, alice, 'tea and cake')
+                cake = posts.add_post(db, alice, 'cake cake cake')
+                posts.add_post(db, alice, 'coffee')
+                posts.add_comment(db, cake, 'alice', 'more tea please')
+
+                found, total = search.search_posts(db, 'cake tea')
+                results[name] = [post['text'] for post in found]
+                self.assertEqual(total, 2)
+                self.assertEqual(results[name], ['cake cake cake', 'tea and cake'])
+
+                search.rebuild_index(db)
+                self.assertEqual([post['text'] for post in search.search_posts(db, 'cake tea')[0]], results[name])
+        self.assertEqual(results['tinydb'], results['sqlite'])
+
+
+if __name__ == '__main__':
+    unittest.main()
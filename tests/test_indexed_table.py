@@ -0,0 +1,109 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+import tinydb
+from tinydb.storages import MemoryStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.storage import WALStorage, WriteBehindJSONStorage
+from db.tables import DB_LOCK, SharedTinyDB, WALTinyDB
+
+Like = tinydb.Query()
+
+
+class IndexedTableDifferentialTest(unittest.TestCase):
+    """
+    Applies the same random writes to an indexed table and to a plain
+    in-memory TinyDB table, checking after each one that every read
+    (indexed or not) agrees and that a reopened WAL database matches.
+    """
+
+    OPERATIONS = 600
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rng = random.Random(7)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_wal(self):
+        return WALTinyDB(os.path.join(self.tmp.name, 'wal.json'), storage=WALStorage,
+                         compact_every=10 ** 6, lock=DB_LOCK)
+
+    def random_write(self):
+        """Returns a function applying one random write to a table, and its result."""
+        choice = self.rng.random()
+        user_id, post_id = self.rng.randrange(8), self.rng.randrange(8)
+        if choice < 0.35:
+            doc = {'user_id': user_id, 'post_id': post_id, 'time': self.rng.random()}
+            if self.rng.random() < 0.2:
+                # Unhashable, so the index can't hold it
+                doc['user_id'] = [user_id]
+            return lambda t: t.insert(dict(doc))
+        if choice < 0.45:
+            docs = [{'user_id': user_id, 'post_id': n, 'time': self.rng.random()} for n in range(3)]
+            return lambda t: t.insert_multiple([dict(doc) for doc in docs])
+        if choice < 0.6:
+            doc_ids = self.rng.sample(range(1, 40), 3)
+            delta = self.rng.randrange(1, 4)
+            def bump(doc):
+                doc['count'] = doc.get('count', 0) + delta
+            return lambda t: sorted(t.update(bump, doc_ids=doc_ids))
+        if choice < 0.7:
+            return lambda t: sorted(t.update({'post_id': post_id}, Like.user_id == user_id))
+        if choice < 0.8:
+            doc_ids = self.rng.sample(range(1, 40), 2)
+            return lambda t: sorted(t.remove(doc_ids=doc_ids))
+        if choice < 0.9:
+            return lambda t: sorted(t.remove((Like.user_id == user_id) & (Like.post_id == post_id)))
+        if choice < 0.93:
+            return lambda t: t.truncate()
+        return lambda t: sorted(t.upsert({'user_id': user_id, 'post_id': post_id, 'time': 0.5},
+                                         (Like.user_id == user_id) & (Like.post_id == post_id)))
+
+    def assert_same(self, expected, actual):
+        self.assertEqual({doc.doc_id: dict(doc) for doc in expected.all()},
+                         {doc.doc_id: dict(doc) for doc in actual.all()})
+        for user_id in range(8):
+            query = Like.user_id == user_id
+            self.assertEqual(expected.search(query), actual.search(query))
+            query = Like.user_id == [user_id]
+            self.assertEqual(expected.search(query), actual.search(query))
+            self.assertEqual(expected.search(query & (Like.post_id == 0)),
+                             actual.search(query & (Like.post_id == 0)))
+            for post_id in range(8):
+                query = (Like.user_id == user_id) & (Like.post_id == post_id)
+                self.assertEqual(expected.search(query), actual.search(query))
+                self.assertEqual(expected.get(query), actual.get(query))
+
+    def check(self, db):
+        reference = tinydb.TinyDB(storage=MemoryStorage).table('likes')
+        table = db.table('likes')
+        for _ in range(self.OPERATIONS):
+            write = self.random_write()
+            self.assertEqual(write(reference), write(table))
+            self.assert_same(reference, table)
+        return reference
+
+    def test_write_behind_json(self):
+        db = SharedTinyDB(os.path.join(self.tmp.name, 'db.json'), storage=WriteBehindJSONStorage,
+                          flush_interval=60, lock=DB_LOCK)
+        self.check(db)
+        db.close()
+
+    def test_wal_survives_reopen(self):
+        db = self.open_wal()
+        reference = self.check(db)
+        db.close()
+
+        db = self.open_wal()
+        self.assert_same(reference, db.table('likes'))
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.storage import WALStorage
+from db.tables import WALTinyDB
+
+
+class WALRecoveryTest(unittest.TestCase):
+    """Restarting after a crash mid-append must not lose later writes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'db.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_db(self):
+        return WALTinyDB(self.path, storage=WALStorage, compact_every=10 ** 6)
+
+    def crash_mid_write(self, lost_bytes):
+        """Cuts the last `lost_bytes` bytes off the log, as a crash during the final append would."""
+        log_path = self.path + '.wal'
+        with open(log_path, 'rb+') as log:
+            log.truncate(os.path.getsize(log_path) - lost_bytes)
+
+    def texts(self):
+        db = self.open_db()
+        try:
+            return [post['text'] for post in db.table('posts').all()]
+        finally:
+            db.close()
+
+    def test_writes_after_torn_record_survive_restart(self):
+        db = self.open_db()
+        db.table('posts').insert({'text': 'first'})
+        db.table('posts').insert({'text': 'second'})
+        db.close()
+
+        self.crash_mid_write(10)
+
+        db = self.open_db()
+        self.assertEqual([post['text'] for post in db.table('posts').all()], ['first'])
+        db.table('posts').insert({'text': 'third'})
+        db.table('posts').insert({'text': 'fourth'})
+        db.close()
+
+        self.assertEqual(self.texts(), ['first', 'third', 'fourth'])
+
+    def test_record_without_newline_is_dropped(self):
+        # The record reached the disk but its newline didn't, so the write
+        # was never acknowledged
+        db = self.open_db()
+        db.table('posts').insert({'text': 'first'})
+        db.table('posts').insert({'text': 'second'})
+        db.close()
+
+        self.crash_mid_write(1)
+
+        db = self.open_db()
+        db.table('posts').insert({'text': 'third'})
+        db.close()
+
+        self.assertEqual(self.texts(), ['first', 'third'])
+
+
+if __name__ == '__main__':
+    unittest.main()
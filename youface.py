@@ -4,17 +4,18 @@
 
 # --- Standard Imports ---
 import os
-import time
 
 # --- Installed Imports ---
 import flask
-import timeago
-from tinydb import TinyDB, Query
+from flask.helpers import get_debug_flag
+from tinydb import Query
+from werkzeug.serving import is_running_from_reloader
 from tinydb.operations import delete # ✅ Import 'delete' operation
 
 # --- Handlers ---
-from handlers import friends, login, posts, leaderboard
-from db import helpers, users
+from handlers import api, friends, login, posts, leaderboard
+from handlers.humanize import time_ago
+from db import helpers, metrics, recommendations, search, users, posts as db_posts
 
 # --- Project Root ---
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -31,51 +32,46 @@ app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
 
+# --- Process Role ---
+# The worker processes that score follow suggestions import this module
+# again under this name, and must not touch the database
+SUGGESTION_WORKER = __name__ == '__mp_main__'
+
+
+def is_serving_process():
+    """
+    Whether this process serves requests. Under the debug reloader
+    (python3 youface.py, flask run --debug) this module is also imported
+    by a parent process that only watches files and restarts the server;
+    the child it starts to serve has WERKZEUG_RUN_MAIN set.
+    """
+    if SUGGESTION_WORKER:
+        return False
+    reloading = __name__ == '__main__' or get_debug_flag()
+    return not reloading or is_running_from_reloader()
+
+
 # --- Database Setup ---
-db_path = os.path.join(PROJECT_ROOT, 'db.json')
-db = TinyDB(db_path)
+# One shared handle per process; handlers reach it through helpers.load_db()
+if not SUGGESTION_WORKER:
+    helpers.init_app(app)
 User = Query()
 
 
 # --- UPDATED: Database Migration Function ---
 def run_db_migration(db):
     """
-    Checks all users in the DB and migrates to the new follow-only system.
-    1. Adds 'following' and 'followers' if they don't exist.
-    2. Deletes old 'friends', 'pending_requests_received', 'pending_requests_sent'.
+    Checks all users in the DB and migrates to the new follow-only system
+    by deleting old 'friends', 'pending_requests_received' and
+    'pending_requests_sent' fields. (Follow edges are set up by
+    run_follow_migration.)
     """
     print("Checking database schema...")
     users_table = db.table('users')
     User = Query()
     
-    # --- 1. Add new fields ---
-    print("Step 1: Adding 'following' and 'followers' fields...")
-    default_schema = {
-        'following': [],
-        'followers': []
-    }
-    query_add = (
-        (~ User.following.exists()) |
-        (~ User.followers.exists())
-    )
-    users_to_add = users_table.search(query_add)
-
-    if not users_to_add:
-        print(" -> 'following' and 'followers' fields are up-to-date.")
-    else:
-        print(f" -> Found {len(users_to_add)} user(s) needing new fields...")
-        for user_doc in users_to_add:
-            update_data = {}
-            for key, default_value in default_schema.items():
-                if key not in user_doc:
-                    update_data[key] = default_value
-            
-            if update_data:
-                print(f"    -> Migrating user: {user_doc['username']}")
-                users_table.update(update_data, User.username == user_doc['username'])
-    
-    # --- 2. Remove old, deprecated fields ---
-    print("\nStep 2: Removing deprecated 'friends' and 'pending_requests' fields...")
+    # --- Remove old, deprecated fields ---
+    print("Removing deprecated 'friends' and 'pending_requests' fields...")
     
     # Check and remove 'friends'
     if users_table.search(User.friends.exists()):
@@ -101,6 +97,63 @@ def run_db_migration(db):
     print("\nDatabase migration complete.")
 
 
+def run_follow_migration(db):
+    """
+    Moves 'following'/'followers' lists out of user documents into the
+    'follows' table, so a popular user's document stays small, and stores
+    follower_count/following_count on each user. Safe to run on every
+    start; users that are already migrated are skipped.
+    """
+    print("Checking follow storage...")
+    moved = users.move_follow_lists(db)
+    if moved:
+        print(f" -> Moved follows out of {moved} user(s).")
+    else:
+        print(" -> Follows are already in their own table.")
+
+
+def run_comment_migration(db):
+    """
+    Moves comments embedded in post documents into the 'comments' table,
+    so a new comment no longer rewrites its whole post. Safe to run on
+    every start; posts without embedded comments are skipped.
+    """
+    print("Checking comment storage...")
+    moved = db_posts.move_embedded_comments(db)
+    if moved:
+        print(f" -> Moved comments out of {moved} post(s).")
+    else:
+        print(" -> Comments are already in their own table.")
+
+
+def run_counter_migration(db):
+    """
+    Backfills the denormalized 'like_count' and 'comment_count' fields on
+    posts, so feed and leaderboard reads never have to recount them.
+    Safe to run on every start; posts that are already correct are skipped.
+    """
+    print("Checking post counters...")
+    fixed = db_posts.backfill_post_counters(db)
+    if fixed:
+        print(f" -> Backfilled like/comment counts on {fixed} post(s).")
+    else:
+        print(" -> Post counters are up-to-date.")
+
+
+def run_search_index(db):
+    """
+    Builds the post search index if it is empty but there are posts to
+    search, e.g. for data written before search existed. New posts and
+    comments are indexed as they are written.
+    """
+    print("Checking search index...")
+    if search.index_is_empty(db):
+        indexed = search.rebuild_index(db)
+        print(f" -> Indexed {indexed} post(s) for search.")
+    else:
+        print(" -> Search index is up-to-date.")
+
+
 # ==============================
 # ROUTES
 # ==============================
@@ -109,6 +162,11 @@ def run_db_migration(db):
 def settings():
     return "Settings page coming soon!"
 
+@app.route('/metrics')
+def show_metrics():
+    """In-process counters and settings (feed fan-out, merge cost) as JSON."""
+    return flask.jsonify(metrics.snapshot())
+
 @app.route('/logout')
 def logout():
     """Logs the user out by clearing cookies."""
@@ -128,7 +186,7 @@ def profile():
         return flask.redirect(flask.url_for('login.loginscreen'))
 
     # --- Load DB and verify user ---
-    # We pass the 'db' instance from the top of this file
+    db = helpers.load_db()
     user_doc = users.get_user(db, username, password) 
     
     if not user_doc:
@@ -154,7 +212,7 @@ def profile():
 @app.template_filter('convert_time')
 def convert_time(ts):
     """A Jinja template helper to convert timestamps to timeago format."""
-    return timeago.format(ts, time.time())
+    return time_ago(ts)
 
 
 # ==============================
@@ -165,6 +223,28 @@ app.register_blueprint(friends.blueprint)
 app.register_blueprint(login.blueprint)
 app.register_blueprint(posts.blueprint)
 app.register_blueprint(leaderboard.blueprint)
+app.register_blueprint(api.blueprint)
+
+
+# ==============================
+# STARTUP
+# ==============================
+
+# Runs however the app is served (python3 youface.py, flask run, a WSGI
+# server). Only the serving process may write db.json (json and wal
+# backends), so the reloader's parent leaves it to the child.
+if is_serving_process():
+    with app.app_context():
+        db = helpers.load_db()
+
+    # --- Bring existing data up to date ---
+    run_follow_migration(db)
+    # (comments move first: the counter backfill counts the comments table)
+    run_comment_migration(db)
+    run_counter_migration(db)
+    run_search_index(db)
+
+    recommendations.start_refresher(db)
 
 
 # ==============================
@@ -172,7 +252,7 @@ app.register_blueprint(leaderboard.blueprint)
 # ==============================
 
 if __name__ == "__main__":
-    
+
     # --- Start the app ---
     app.run(debug=True, host='0.0.0.0', port=5005)
     app.run(host='0.0.0.0', port=5005)